@@ -0,0 +1,117 @@
+"""
+Times robot_pose_selector, Calibrator4DOF.calibrate and nonlinear_refinement on
+synthetic SCARA data of increasing size and records the accuracy against the known
+ground truth. Results are written as JSON so runs from different commits can be
+compared with --compare.
+"""
+
+import argparse
+import json
+import platform
+import subprocess
+import time
+import numpy as np
+import scipy
+from handeye_4dof import Calibrator4DOF, robot_pose_selector
+from handeye_4dof.synthetic import generate_scara_data, calibration_error
+
+
+def timed(fn, repeat):
+    best, result = np.inf, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_size(n, args):
+    robot_poses, sensor_poses, X = generate_scara_data(n, args.mode, trans_noise=args.trans_noise,
+                                                       rot_noise=args.rot_noise, outlier_fraction=args.outliers,
+                                                       seed=args.seed)
+    entry = {"n": n, "indexed_selector": n > args.exact_limit}
+
+    try:
+        entry["select_s"], motions = timed(lambda: robot_pose_selector(sensor_poses, robot_poses,
+                                                                       indexed=entry["indexed_selector"]),
+                                           args.repeat)
+        # Singular values grow with sqrt(N), so the limit is scaled for large pose sets.
+        sv_limit = args.sv_limit if args.sv_limit is not None else 0.5 * max(1.0, np.sqrt(n / 1000))
+        cb = Calibrator4DOF(motions, sv_limit=sv_limit)
+        entry["calibrate_s"], dq_x = timed(lambda: cb.calibrate(antiparallel_screw_axes=True), args.repeat)
+        estimate = np.linalg.inv(dq_x.as_transform())
+        entry["calibrate_trans_err"], entry["calibrate_rot_err"] = calibration_error(estimate, X)
+
+        entry["refine_s"], refined = timed(lambda: cb.nonlinear_refinement(sensor_poses, robot_poses, estimate),
+                                           args.repeat)
+        entry["refine_trans_err"], entry["refine_rot_err"] = calibration_error(refined, X)
+    except AssertionError as e:
+        entry["error"] = str(e)
+
+    return entry
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = {r["n"]: r for r in json.load(f)["results"]}
+
+    print("Speedup vs {} (baseline time / current time):".format(baseline_path))
+    for r in results:
+        b = baseline.get(r["n"])
+        if b is None:
+            continue
+        ratios = ["{} {:.2f}x".format(stage, b[stage] / r[stage]) for stage in ("select_s", "calibrate_s", "refine_s")
+                  if stage in r and stage in b and r[stage] > 0]
+        print("  N={:<7d} {}".format(r["n"], ", ".join(ratios)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Handeye-4DOF scaling benchmark on synthetic SCARA data.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000, 100000],
+                        help="numbers of poses to benchmark")
+    parser.add_argument("--mode", choices=["eye_in_hand", "eye_on_base"], default="eye_in_hand",
+                        help="calibration type of the synthetic data")
+    parser.add_argument("--transNoise", dest="trans_noise", type=float, default=1e-3,
+                        help="standard deviation of the sensor translation noise in meters")
+    parser.add_argument("--rotNoise", dest="rot_noise", type=float, default=1e-3,
+                        help="standard deviation of the sensor rotation noise in radians")
+    parser.add_argument("--outliers", type=float, default=0.0,
+                        help="fraction of sensor poses replaced by outliers")
+    parser.add_argument("--exactLimit", dest="exact_limit", type=int, default=5000,
+                        help="largest number of poses for the exact O(N^2) pose selector, above it the indexed one is used")
+    parser.add_argument("--svLimit", dest="sv_limit", type=float,
+                        help="singular value limit of the calibrator, scaled with sqrt(N / 1000) by default")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="report the best of n runs of each stage")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="random seed for the synthetic data")
+    parser.add_argument("-o", "--output", default="benchmark_results.json",
+                        help="path of the JSON results file")
+    parser.add_argument("--compare", dest="compare_path",
+                        help="JSON results of an earlier run to compare timings against")
+
+    args = parser.parse_args()
+
+    results = []
+    for n in args.sizes:
+        entry = run_size(n, args)
+        results.append(entry)
+        print(json.dumps(entry))
+
+    with open(args.output, "w") as f:
+        json.dump({"commit": git_commit(), "python": platform.python_version(), "numpy": np.__version__,
+                   "scipy": scipy.__version__, "args": vars(args), "results": results}, f, indent=2)
+
+    if args.compare_path is not None:
+        compare(results, args.compare_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,17 @@
 import argparse
+import json
+import logging
 import random
 import pickle
+import sys
 import numpy as np
-from scipy.spatial.transform import Rotation as R
 from handeye_4dof import Calibrator4DOF, robot_pose_selector
+from handeye_4dof.evaluation import cross_validate, evaluate
+from handeye_4dof.instrumentation import get_instrumentation
+from handeye_4dof.batch import run_batch
+from handeye_4dof.cache import DEFAULT_CACHE_DIR, MotionCache, cached_robot_pose_selector
+from handeye_4dof.storage import load_poses, load_motions, save_motions
+from handeye_4dof.utils import matrix_to_euler_xyz
 
 
 np.set_printoptions(suppress=True)
@@ -21,39 +29,86 @@ def main():
                         help="perform 180 x-axis rotation to avoid matrix rank loss due to anti-parallel screw axes")
     parser.add_argument("-n", "--nonlinear", action="store_true",
                         help="perform nonlinear optimization on calibration result using pose pairs")
+    parser.add_argument("--cacheDir", dest="cache_dir", default=DEFAULT_CACHE_DIR,
+                        help="directory of the motion cache used when computing motions")
+    parser.add_argument("--noCache", dest="no_cache", action="store_true",
+                        help="always recompute motions instead of using the motion cache")
+    parser.add_argument("--profile", nargs="?", const="-",
+                        help="write a JSON report of per-stage timings and counters to the given path (stdout if omitted)")
+    parser.add_argument("--batch", dest="batch_manifest",
+                        help="calibrate every rig listed in a JSON manifest in a process pool (see handeye_4dof/batch.py)")
+    parser.add_argument("--batchOutput", dest="batch_output", default="batch_results.json",
+                        help="path of the consolidated JSON results of --batch")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="maximum number of rigs calibrated concurrently in --batch mode")
     parser.add_argument("-s", "--sample", type=int, default=-1,
                         help="randomly sample n motions for calibration")
+    parser.add_argument("-r", "--ransac", type=int, default=-1,
+                        help="perform robust RANSAC calibration over n random motion subsets")
+    parser.add_argument("--ransacThreshold", dest="ransac_threshold", type=float, default=0.1,
+                        help="motion residual below which a motion counts as a RANSAC inlier")
+    parser.add_argument("--irls", choices=["huber", "cauchy"],
+                        help="perform robust calibration by iteratively reweighting motions with the given loss")
+    parser.add_argument("-b", "--bootstrap", type=int, default=-1,
+                        help="estimate calibration uncertainty from n bootstrap replicates of the motions")
+    parser.add_argument("-e", "--evaluate", action="store_true",
+                        help="report per-pose consistency errors and AX=XB residuals of the result using pose pairs")
+    parser.add_argument("-k", "--kfold", type=int, default=-1,
+                        help="estimate the held-out pose error by k-fold cross-validation using pose pairs")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="random seed for RANSAC subset sampling and bootstrap resampling")
 
     args = parser.parse_args()
 
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    if args.batch_manifest is not None:
+        results = run_batch(args.batch_manifest, args.batch_output, max_workers=args.jobs)
+        for r in results:
+            print("{}: {}".format(r["name"], r["status"] if r["status"] == "ok" else r["error"]))
+        print("Wrote {} results to {}.".format(len(results), args.batch_output))
+        return
+
     if args.pose_path is not None:
-        with open(args.pose_path, "rb") as f:
-            try:
-                base_to_hand, camera_to_marker = pickle.load(f)
-            except UnicodeDecodeError:
-                # python 2 to python 3 pickle in case sampling was done in ROS
-                base_to_hand, camera_to_marker = pickle.load(f, encoding='latin1')
+        base_to_hand, camera_to_marker = load_poses(args.pose_path)
 
+    screws = None
     if args.compute_motions:
         assert args.pose_path is not None, "Can't compute motions without poses. Please specify -p."
-        motions = robot_pose_selector(camera_to_marker, base_to_hand)
+        if args.no_cache:
+            motions = robot_pose_selector(camera_to_marker, base_to_hand)
+        else:
+            motions, screws = cached_robot_pose_selector(camera_to_marker, base_to_hand, MotionCache(args.cache_dir),
+                                                         return_screws=True)
         if args.motion_path is not None:
-            with open(args.motion_path, "wb") as f:
-                pickle.dump(motions, f)
+            if args.motion_path.endswith(".pkl"):
+                with open(args.motion_path, "wb") as f:
+                    pickle.dump(motions, f)
+            else:
+                save_motions(args.motion_path, motions)
     else:
         assert args.motion_path is not None, "Can't calibrate without computing or specifying precomputed motions. " \
                                              "Please specify -c or -m."
-        with open(args.motion_path, "rb") as f:
-            motions = pickle.load(f)
+        motions = load_motions(args.motion_path)
 
     if args.sample > 0:
-        motions = random.sample(motions, k=args.sample)
+        idx = random.sample(range(len(motions)), k=args.sample)
+        motions = motions[idx] if isinstance(motions, np.ndarray) else [motions[i] for i in idx]
+        screws = None if screws is None else screws[idx]
 
     # Initialize calibrator with motions.
-    cb = Calibrator4DOF(motions)
+    cb = Calibrator4DOF(motions, screws=screws)
 
     # Our camera and end effector z-axes are antiparallel, so we must apply a 180deg x-axis rotation.
-    dq_x = cb.calibrate(antiparallel_screw_axes=args.antiparallel_axes)
+    if args.ransac > 0:
+        dq_x, inliers = cb.calibrate_ransac(antiparallel_screw_axes=args.antiparallel_axes, n_hypotheses=args.ransac,
+                                            threshold=args.ransac_threshold, seed=args.seed)
+        print("RANSAC kept {} of {} motions.".format(inliers.sum(), len(inliers)))
+    elif args.irls is not None:
+        dq_x, weights = cb.calibrate_irls(antiparallel_screw_axes=args.antiparallel_axes, loss=args.irls)
+        print("IRLS downweighted {} of {} motions below 0.5.".format((weights < 0.5).sum(), len(weights)))
+    else:
+        dq_x = cb.calibrate(antiparallel_screw_axes=args.antiparallel_axes)
 
     # Calibration Obtained Hand to Camera
     hand_to_camera = np.linalg.inv(dq_x.as_transform())
@@ -63,12 +118,50 @@ def main():
         assert args.pose_path is not None, "Can't perform nonlinear refinement without poses. Please specify -p."
         hand_to_camera = cb.nonlinear_refinement(camera_to_marker, base_to_hand, hand_to_camera)
 
-    rotation = np.rad2deg(R.from_matrix(hand_to_camera[:3, :3]).as_euler('xyz'))
+    rotation = matrix_to_euler_xyz(hand_to_camera[:3, :3], degrees=True)
 
     np.set_printoptions(precision=5)
     print("Translation:  {}".format(hand_to_camera[:3, -1]))
     print("XYZ Euler:    {}".format(rotation))
 
+    if args.bootstrap > 0:
+        stats = cb.uncertainty(antiparallel_screw_axes=args.antiparallel_axes, n_replicates=args.bootstrap,
+                               seed=args.seed)
+        low, high = stats["percentiles"][2.5], stats["percentiles"][97.5]
+        print("Bootstrap ({} replicates, {} failed) of linear calibration, tx ty [m] and XYZ Euler [deg]:"
+              .format(args.bootstrap, stats["failed"]))
+        print("  Std dev:    {}".format(np.sqrt(np.diag(stats["covariance"]))))
+        print("  2.5%:       {}".format(low))
+        print("  97.5%:      {}".format(high))
+
+    if args.evaluate:
+        assert args.pose_path is not None, "Can't evaluate without poses. Please specify -p."
+        result = evaluate(camera_to_marker, base_to_hand, hand_to_camera)
+        print("Consistency error, translation [m]: mean {mean:.5f}  rms {rms:.5f}  max {max:.5f}".format(
+            **result["translation"]))
+        print("Consistency error, rotation [deg]:  mean {:.5f}  rms {:.5f}  max {:.5f}".format(
+            *np.rad2deg([result["rotation"][s] for s in ("mean", "rms", "max")])))
+        print("AX=XB residual, translation [m]:    mean {mean:.5f}  rms {rms:.5f}  max {max:.5f}".format(
+            **result["ax_xb_translation"]))
+        print("Worst poses:  {}".format(result["worst_poses"]))
+
+    if args.kfold > 0:
+        assert args.pose_path is not None, "Can't cross-validate without poses. Please specify -p."
+        result = cross_validate(camera_to_marker, base_to_hand, k=args.kfold,
+                                antiparallel_screw_axes=args.antiparallel_axes, nonlinear=args.nonlinear, seed=args.seed)
+        assert result["translation"] is not None, "All cross-validation folds failed."
+        print("{}-fold held-out error, translation [m]: mean {mean:.5f}  rms {rms:.5f}  max {max:.5f}".format(
+            args.kfold, **result["translation"]))
+        print("Worst held-out poses:  {}".format(result["worst_poses"]))
+
+    if args.profile is not None:
+        report = json.dumps(get_instrumentation().report(), indent=2)
+        if args.profile == "-":
+            sys.stdout.write(report + "\n")
+        else:
+            with open(args.profile, "w") as f:
+                f.write(report)
+
 
 if __name__ == '__main__':
     main()
@@ -1,6 +1,6 @@
 import pickle
 import numpy as np
-from scipy.spatial.transform import Rotation as R
+from handeye_4dof.utils import matrix_to_euler_xyz
 from handeye_4dof import Calibrator4DOF, robot_pose_selector
 
 
@@ -30,8 +30,8 @@ def main():
     # Hand to Camera TF obtained from post nonlinear refinement.
     nl_hand_to_camera = cb.nonlinear_refinement(camera_to_marker, base_to_hand, ca_hand_to_camera)
 
-    ca_rotation = np.rad2deg(R.from_matrix(ca_hand_to_camera[:3, :3]).as_euler('xyz'))
-    nl_rotation = np.rad2deg(R.from_matrix(nl_hand_to_camera[:3, :3]).as_euler('xyz'))
+    ca_rotation = matrix_to_euler_xyz(ca_hand_to_camera[:3, :3], degrees=True)
+    nl_rotation = matrix_to_euler_xyz(nl_hand_to_camera[:3, :3], degrees=True)
 
     # Ground Truth Hand to Camera
     gt_translation = [-0.456, -0.037, -0.112]
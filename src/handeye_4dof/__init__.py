@@ -1,3 +1,6 @@
 from .calibrator import Calibrator4DOF
-from .dual_quaternions import DualQuaternion
-from .pose_selector import robot_pose_selector
+from .dual_quaternions import DualQuaternion, DualQuaternionArray
+from .incremental import IncrementalCalibrator4DOF
+from .pose_selector import robot_pose_selector, indexed_robot_pose_selector, conditioning_motion_selector
+from .pose_set import PoseSet
+from .quaternions import Quaternion, QuaternionArray
@@ -0,0 +1,117 @@
+"""
+Batch calibration of many rigs in one process pool.
+
+The manifest is a JSON file of the form
+    {
+        "defaults": {"antiparallel_axes": true},
+        "rigs": [
+            {"name": "cell_1", "pose_path": "cell_1.npz", "nonlinear": true},
+            {"name": "cell_2", "pose_path": "cell_2.pkl", "motion_path": "cell_2_motions.npz"}
+        ]
+    }
+Relative paths are resolved against the manifest's directory. Per rig options are
+pose_path, motion_path, antiparallel_axes, nonlinear, sv_limit, cache_dir and no_cache.
+"""
+
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from .cache import DEFAULT_CACHE_DIR, MotionCache, cached_robot_pose_selector
+from .calibrator import Calibrator4DOF
+from .pose_selector import robot_pose_selector
+from .storage import load_poses, load_motions
+from .utils import matrix_to_euler_xyz
+
+
+RIG_DEFAULTS = {
+    "pose_path": None,
+    "motion_path": None,
+    "antiparallel_axes": False,
+    "nonlinear": False,
+    "sv_limit": 0.5,
+    "cache_dir": DEFAULT_CACHE_DIR,
+    "no_cache": False,
+}
+
+
+def load_manifest(path):
+    with open(path) as f:
+        manifest = json.load(f)
+
+    base_dir = os.path.dirname(os.path.abspath(path))
+    defaults = dict(RIG_DEFAULTS, **manifest.get("defaults", {}))
+
+    rigs = []
+    for i, entry in enumerate(manifest["rigs"]):
+        rig = dict(defaults, **entry)
+        rig.setdefault("name", "rig_{}".format(i))
+        # Absolute paths, like the default cache_dir, are kept by os.path.join.
+        for key in ("pose_path", "motion_path", "cache_dir"):
+            if rig[key] is not None:
+                rig[key] = os.path.join(base_dir, os.path.expanduser(rig[key]))
+        rigs.append(rig)
+    return rigs
+
+
+def transform_summary(hand_to_camera):
+    return {
+        "hand_to_camera": hand_to_camera.tolist(),
+        "translation": hand_to_camera[:3, -1].tolist(),
+        "xyz_euler_deg": matrix_to_euler_xyz(hand_to_camera[:3, :3], degrees=True).tolist(),
+    }
+
+
+def calibrate_rig(rig):
+    """
+    Calibrate a single rig described by a manifest entry. Failures (including the
+    calibrate() assertions) are reported in the result instead of being raised.
+    """
+    rig = dict(RIG_DEFAULTS, **rig)
+    result = {"name": rig.get("name"), "status": "ok"}
+    start = time.perf_counter()
+
+    try:
+        base_to_hand, camera_to_marker, screws = None, None, None
+        if rig["pose_path"] is not None:
+            base_to_hand, camera_to_marker = load_poses(rig["pose_path"])
+
+        if rig["motion_path"] is not None and os.path.exists(rig["motion_path"]):
+            motions = load_motions(rig["motion_path"])
+        else:
+            assert base_to_hand is not None, "Can't compute motions without poses. Please specify pose_path."
+            if rig["no_cache"]:
+                motions = robot_pose_selector(camera_to_marker, base_to_hand)
+            else:
+                motions, screws = cached_robot_pose_selector(camera_to_marker, base_to_hand,
+                                                             MotionCache(rig["cache_dir"]), return_screws=True)
+
+        cb = Calibrator4DOF(motions, sv_limit=rig["sv_limit"], screws=screws)
+        dq_x = cb.calibrate(antiparallel_screw_axes=rig["antiparallel_axes"])
+        hand_to_camera = np.linalg.inv(dq_x.as_transform())
+
+        if rig["nonlinear"]:
+            assert base_to_hand is not None, "Can't perform nonlinear refinement without poses. Please specify pose_path."
+            hand_to_camera = cb.nonlinear_refinement(camera_to_marker, base_to_hand, hand_to_camera)
+
+        result.update(transform_summary(hand_to_camera))
+    except Exception as e:
+        result["status"] = "error"
+        result["error"] = "{}: {}".format(type(e).__name__, e)
+
+    result["elapsed_s"] = time.perf_counter() - start
+    return result
+
+
+def calibrate_rigs(rigs, max_workers=None):
+    # At most max_workers rigs are calibrated at once, results keep the manifest order.
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(calibrate_rig, rigs))
+
+
+def run_batch(manifest_path, output_path, max_workers=None):
+    results = calibrate_rigs(load_manifest(manifest_path), max_workers=max_workers)
+    with open(output_path, "w") as f:
+        json.dump({"manifest": os.path.abspath(manifest_path), "results": results}, f, indent=2)
+    return results
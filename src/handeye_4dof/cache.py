@@ -0,0 +1,115 @@
+import hashlib
+import json
+import os
+import tempfile
+import numpy as np
+from . import instrumentation
+from .calibrator import motion_screw_params, motions_as_arrays
+from .pose_selector import robot_pose_selector
+
+
+CACHE_VERSION = 3
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "handeye_4dof")
+
+
+def motion_cache_key(tf1, tf2, **selector_params):
+    h = hashlib.sha256()
+    h.update(json.dumps({"version": CACHE_VERSION, "params": selector_params}, sort_keys=True).encode())
+    for tfs in (tf1, tf2):
+        tfs = np.ascontiguousarray(tfs, dtype=np.float64)
+        h.update(str(tfs.shape).encode())
+        h.update(tfs.tobytes())
+    return h.hexdigest()
+
+
+class MotionCache:
+    """
+    On-disk cache of selected motions, keyed by motion_cache_key. Each entry is an .npz
+    holding the (N, 2, 8) motions and the (N, 2, 8) screw parameters [axis, d, moment, theta]
+    of A and B. Entries are written to a temporary file and renamed into place, so concurrent
+    readers and writers never see partial files. Reading an entry refreshes its modification
+    time, and the least recently used entries are evicted once max_bytes is exceeded.
+    """
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=512 * 2**20):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".npz")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with np.load(path) as data:
+                motions, screws = data["motions"], data["screws"]
+            os.utime(path)
+        except (FileNotFoundError, OSError, KeyError, ValueError):
+            # Missing, concurrently evicted or unreadable entries count as a miss.
+            return None
+        return motions, screws
+
+    def put(self, key, motions, screws=None):
+        A, B = motions_as_arrays(motions)
+        if screws is None:
+            screws = motion_screw_params(A, B)
+
+        fd, tmp = tempfile.mkstemp(suffix=".tmp", dir=self.directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, motions=np.stack((A.dqs, B.dqs), axis=1), screws=screws)
+            os.replace(tmp, self._path(key))
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".npz"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                # Another process evicted it first.
+                pass
+            total -= size
+
+
+def cached_robot_pose_selector(tf1, tf2, cache=None, return_screws=False, **selector_params):
+    """
+    robot_pose_selector that reuses previously selected motions for identical poses and
+    selector parameters. Motions are returned as an (N, 2, 8) array whether or not they
+    were cached, unless a motion lacks its partner pose. With return_screws, their
+    (N, 2, 8) screw parameters are returned as well, to be passed on to Calibrator4DOF.
+    """
+    cache = MotionCache() if cache is None else cache
+    key = motion_cache_key(tf1, tf2, **selector_params)
+
+    hit = cache.get(key)
+    if hit is not None:
+        instrumentation.count("motion_cache_hits")
+        instrumentation.message("Loaded {} cached motions.".format(len(hit[0])))
+        return hit if return_screws else hit[0]
+
+    instrumentation.count("motion_cache_misses")
+    motions = robot_pose_selector(tf1, tf2, **selector_params)
+    if not all(m is not None for m in motions):
+        return (motions, None) if return_screws else motions
+    A, B = motions_as_arrays(motions)
+    motions, screws = np.stack((A.dqs, B.dqs), axis=1), motion_screw_params(A, B)
+    cache.put(key, motions, screws)
+    return (motions, screws) if return_screws else motions
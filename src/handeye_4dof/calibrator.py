@@ -1,14 +1,197 @@
-import sympy as sy
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError, as_completed
 import numpy as np
-from scipy.optimize import minimize
-from .dual_quaternions import DualQuaternion
-from .utils import vec_to_skew_symmetric_mat, rotation_matrix_constraints, obtain_tf_from_rolled_arr
+from . import instrumentation
+from .dual_quaternions import DualQuaternion, DualQuaternionArray
+from .pose_set import PoseSet
+from .utils import vec_to_skew_symmetric_mat, rotation_matrix_constraints, obtain_tf_from_rolled_arr, \
+    rotvec_to_matrix, rotvec_to_matrix_jacobian, matrix_to_euler_xyz
+
+
+def motions_as_arrays(motions):
+    # Motions may be given as a list of (A, B) DualQuaternion pairs, a pair of
+    # DualQuaternionArrays or an (N, 2, 8) array of dual quaternion vectors.
+    if isinstance(motions, np.ndarray):
+        return DualQuaternionArray(motions[:, 0]), DualQuaternionArray(motions[:, 1])
+    if len(motions) == 2 and isinstance(motions[0], DualQuaternionArray):
+        return motions[0], motions[1]
+    return (DualQuaternionArray.from_list([A for A, _ in motions]),
+            DualQuaternionArray.from_list([B for _, B in motions]))
+
+
+def motion_screw_params(A, B):
+    # (N, 2, 8) screw parameters [axis, d, moment, theta] of the DualQuaternionArrays A and B.
+    return np.stack([np.column_stack((L, d, M, theta)) for L, d, M, theta in
+                     (A.as_screw_params(), B.as_screw_params())], axis=1)
+
+
+def _antiparallel_rotations():
+    # 180deg x-axis rotation and its conjugate.
+    dq_rot1 = DualQuaternion.from_pose([0., 0., 0.], [0., 1., 0., 0.])
+    return dq_rot1, dq_rot1.dq_conjugate1()
+
+
+class _RefinementStopped(Exception):
+    pass
+
+
+def _fit_transform_least_squares(targets, x0, stop=None):
+    """
+    Transform X minimizing sum_i tr((X - targets_i) W (X - targets_i)^T) with W = diag(1, 1, 1, 9),
+    the same objective as the SLSQP refinement. The rotation is parameterized as exp([w]x) R0 and
+    tz is held at 0 since it cannot be solved for. Raises _RefinementStopped once stop is set.
+    """
+    # Imported on first use so that the linear calibration only needs NumPy.
+    from scipy.optimize import least_squares
+
+    R0 = x0[:3, :3]
+    # Translation residuals are scaled by sqrt(9) to match the weighting W.
+    t_targets = 3 * targets[:, :2, -1]
+    R_targets = targets[:, :3, :3].reshape(len(targets), 9)
+
+    def residuals(p):
+        if stop is not None and stop.is_set():
+            raise _RefinementStopped()
+        R = rotvec_to_matrix(p[:3]).dot(R0)
+        return np.hstack((R.ravel() - R_targets, 3 * p[3:] - t_targets)).ravel()
+
+    def jacobian(p):
+        dR = np.matmul(rotvec_to_matrix_jacobian(p[:3]), R0).reshape(3, 9).T
+        J = np.zeros((len(targets), 11, 5))
+        J[:, :9, :3] = dR
+        J[:, 9, 3] = J[:, 10, 4] = 3
+        return J.reshape(-1, 5)
+
+    result = least_squares(residuals, np.hstack(([0., 0., 0.], x0[:2, -1])), jac=jacobian, method="lm")
+    instrumentation.count("objective_evaluations", result.nfev)
+    instrumentation.count("jacobian_evaluations", result.njev or 0)
+    p = result.x
+
+    tf = np.eye(4)
+    tf[:3, :3] = rotvec_to_matrix(p[:3]).dot(R0)
+    tf[:2, -1] = p[3:]
+    return tf
+
+
+def _weighted_transform_error(tf, targets):
+    # sum_i tr((tf - targets_i) W (tf - targets_i)^T) with W = diag(1, 1, 1, 9), leaving out the
+    # tz term, which the fit keeps at 0 and so adds the same constant to every start.
+    weights = np.array([[1, 1, 1, 9], [1, 1, 1, 9], [1, 1, 1, 0]])
+    return float(np.sum((tf[:3] - targets[:, :3])**2 * weights))
+
+
+def _refine_from_seed(base_to_marker, hand_to_base, marker_to_camera, seed=0, stop=None):
+    # Once stop is set the start is abandoned and returns without a cost.
+    start = time.perf_counter()
+    try:
+        nl_base_to_marker = _fit_transform_least_squares(base_to_marker, base_to_marker[seed], stop)
+
+        # Now that we optimized to obtain base to marker transform, we perform the optimization
+        # once more to regain the hand to camera transform (the one we care about).
+        hand_to_camera = np.matmul(np.matmul(hand_to_base, nl_base_to_marker), marker_to_camera)
+        nl_hand_to_camera = _fit_transform_least_squares(hand_to_camera, hand_to_camera[seed], stop)
+    except _RefinementStopped:
+        return None, None, seed, time.perf_counter() - start
+
+    cost = (_weighted_transform_error(nl_base_to_marker, base_to_marker) +
+            _weighted_transform_error(nl_hand_to_camera, hand_to_camera))
+    return nl_hand_to_camera, cost, seed, time.perf_counter() - start
+
+
+def _diverse_seeds(base_to_marker, n_starts):
+    # Farthest point sampling over the per-pose base to marker estimates, starting from pose 0.
+    flat = base_to_marker[:, :3, :].reshape(len(base_to_marker), -1)
+    seeds = [0]
+    dist = np.linalg.norm(flat - flat[0], axis=1)
+    while len(seeds) < min(n_starts, len(flat)):
+        seeds.append(int(np.argmax(dist)))
+        dist = np.minimum(dist, np.linalg.norm(flat - flat[seeds[-1]], axis=1))
+    return seeds
+
+
+# Shared per-worker state for the process pools below, set once by the pool initializer.
+_pool_state = {}
+
+
+def _pool_init(state):
+    _pool_state.update(state)
+    _pool_state["calibrator"] = Calibrator4DOF([], state["sv_limit"])
+
+
+def _sample_subsets(rng, n, size, count):
+    # count uniform subsets of size distinct indices below n, redrawing rows with duplicates.
+    assert size <= n, "Can't draw subsets of {} from {} motions.".format(size, n)
+    subsets = rng.integers(n, size=(count, size))
+    redraw = np.arange(count)
+    while len(redraw):
+        rows = np.sort(subsets[redraw], axis=1)
+        redraw = redraw[np.any(rows[:, 1:] == rows[:, :-1], axis=1)]
+        subsets[redraw] = rng.integers(n, size=(len(redraw), size))
+    return subsets
+
+
+def _ransac_score(subsets):
+    # Stops at the deadline and returns the scores of the subsets solved so far.
+    state = _pool_state
+    scores = []
+    for subset in subsets:
+        if state["deadline"] is not None and time.time() > state["deadline"]:
+            break
+        try:
+            dq_x = state["calibrator"].solve_normal_matrix(state["contributions"][subset].sum(axis=0),
+                                                           state["antiparallel_screw_axes"])
+        except AssertionError:
+            scores.append((-1, np.inf))
+            continue
+        r = Calibrator4DOF.motion_residuals(state["blocks"], dq_x, state["antiparallel_screw_axes"])
+        r[state["antiparallel"]] = np.inf
+        inliers = r < state["threshold"]
+        scores.append((np.count_nonzero(inliers), r[inliers].sum()))
+    return scores
+
+
+def _calibration_params(dq_x):
+    # Translation x, y and XYZ Euler angles (deg) of the hand to camera transform, tz is not observable.
+    hand_to_camera = np.linalg.inv(dq_x.as_transform())
+    euler = matrix_to_euler_xyz(hand_to_camera[:3, :3], degrees=True)
+    return np.hstack((hand_to_camera[:2, -1], euler))
+
+
+def _resample_solve(weights):
+    state = _pool_state
+    params = np.full((len(weights), 5), np.nan)
+    for i, w in enumerate(weights):
+        try:
+            dq_x = state["calibrator"].solve_normal_matrix(np.tensordot(w, state["contributions"], axes=1),
+                                                           state["antiparallel_screw_axes"])
+        except AssertionError:
+            continue
+        params[i] = _calibration_params(dq_x)
+    return params
+
+
+def _jackknife_solve(left_out):
+    # Leave-one-out replicates subtract a single contribution from the precomputed total.
+    state = _pool_state
+    params = np.full((len(left_out), 5), np.nan)
+    for i, j in enumerate(left_out):
+        try:
+            dq_x = state["calibrator"].solve_normal_matrix(state["total"] - state["contributions"][j],
+                                                           state["antiparallel_screw_axes"])
+        except AssertionError:
+            continue
+        params[i] = _calibration_params(dq_x)
+    return params
 
 
 class Calibrator4DOF:
-    def __init__(self, motions, sv_limit=0.5):
+    def __init__(self, motions, sv_limit=0.5, screws=None):
+        # Optional precomputed (N, 2, 8) motion_screw_params of the motions, e.g. from the motion cache.
         self.motions = motions
         self.sv_limit = sv_limit
+        self.screws = screws
 
     @staticmethod
     def convert_to_dual_vector(A, B):
@@ -25,51 +208,61 @@ class Calibrator4DOF:
 
         return dqs
 
-    def calibrate(self, antiparallel_screw_axes=False):
-        T = np.zeros((6*len(self.motions), 8))
-
-        dq_rot1 = DualQuaternion.from_pose([0., 0., 0.], [0., 1., 0., 0.])
-        dq_rot2 = dq_rot1.dq_conjugate1()
-
-        for i, (A, B) in enumerate(self.motions):
-            dq_a, dq_b = self.convert_to_dual_vector(A, B)
-
-            if antiparallel_screw_axes:
-                dq_a = dq_rot1 * dq_a * dq_rot2
-
-            a_vec_r = dq_a.real.quat[1:]
-            b_vec_r = dq_b.real.quat[1:]
-            a_vec_d = dq_a.dual.quat[1:]
-            b_vec_d = dq_b.dual.quat[1:]
-
-            assert a_vec_r.dot(b_vec_r) > 0, "Error! Screw axes are anti-parallel. Matrix rank is being reduced."
+    @staticmethod
+    def convert_to_dual_vectors(A, B, screws=None):
+        # Batched convert_to_dual_vector for DualQuaternionArrays, reusing screws if given.
+        dqs, dists = [], []
+        for k, dq in enumerate([A, B]):
+            if screws is None:
+                L, d, M = dq.as_screw_params()[:-1]
+            else:
+                L, d, M = screws[:, k, :3], screws[:, k, 3], screws[:, k, 4:7]
+            dists.append(d)
+            dqs.append(DualQuaternionArray.from_dual_vector(L, M))
 
-            T[i*6:i*6+3, 0] = a_vec_r - b_vec_r
-            T[i*6:i*6+3, 1:4] = vec_to_skew_symmetric_mat(a_vec_r + b_vec_r)
-            T[i*6+3:i*6+6, 0] = a_vec_d - b_vec_d
-            T[i*6+3:i*6+6, 1:4] = vec_to_skew_symmetric_mat(a_vec_d + b_vec_d)
-            T[i*6+3:i*6+6, 4] = a_vec_r - b_vec_r
-            T[i*6+3:i*6+6, 5:] = vec_to_skew_symmetric_mat(a_vec_r + b_vec_r)
+        # Fix screw sign ambiguity
+        flip = (dists[0] < 0) & (dists[1] < 0)
+        dqs[0].dqs[flip] *= -1
+        dqs[1].dqs[flip] *= -1
 
-        U, s, Vt = np.linalg.svd(T)
+        return dqs
 
-        # Check that singular values are as expected.
-        for i, sv in enumerate(s):
-            if i < 5:
-                assert sv > self.sv_limit, "Singular value {} was {} < the limit {}.".format(i, sv, self.sv_limit)
+    @staticmethod
+    def _solve_unity_constraints(u1, v1, u2, v2):
+        # Dual quaternion unity constraints
+        #   l1^2 u1.u1 + 2 l1 l2 u1.u2 + l2^2 u2.u2 = 1
+        #   l1^2 u1.v1 + l1 l2 (u1.v2 + u2.v1) + l2^2 u2.v2 = 0
+        # Dividing the second by l2^2 gives a quadratic in s = l1 / l2, the first then fixes l2.
+        p, q, r = u1.dot(v1), u1.dot(v2) + u2.dot(v1), u2.dot(v2)
+
+        if abs(p) > 1e-12:
+            disc = q**2 - 4*p*r
+            if disc < 0:
+                roots = []
             else:
-                # The last 3 singular values should be reasonably close to zero.
-                assert sv < self.sv_limit, "Singular value {} was {} > the limit {}.".format(i, sv, self.sv_limit)
+                # Numerically stable form of the quadratic formula.
+                k = -0.5 * (q + np.copysign(np.sqrt(disc), q))
+                roots = [k / p, r / k] if k != 0 else [0.0]
+        else:
+            roots = [-r / q] if q != 0 else []
 
-        # Rows are same as V column vectors
-        v6 = Vt[5]
-        v7 = Vt[6]
+        # Choose max s = l1/l2 value as solution.
+        curr_s, curr_max = 0, 0
+        for s in roots:
+            val = s**2*u1.dot(u1) + 2*s*u1.dot(u2) + u2.dot(u2)
+            if val > curr_max:
+                curr_max = val
+                curr_s = s
 
-        u1 = v6[:4]
-        v1 = v6[4:]
-        u2 = v7[:4]
-        v2 = v7[4:]
+        assert curr_max > 0, "Couldn't find a solution."
+
+        l2 = 1 / np.sqrt(curr_max)
+        return curr_s * l2, l2
 
+    @staticmethod
+    def _solve_unity_constraints_symbolic(u1, v1, u2, v2):
+        # Original sympy based solver, kept as a cross-check for _solve_unity_constraints.
+        import sympy as sy
         l1s, l2s = sy.symbols('l1, l2', real=True)
 
         # Dual quaternion unity constraints
@@ -91,22 +284,398 @@ class Calibrator4DOF:
                     curr_max = val
                     curr_l1, curr_l2 = float(l1), float(l2)
             except TypeError:
-                print("Detected Type Error")
+                instrumentation.message("Detected Type Error")
 
         assert curr_l1 != 0 and curr_l2 != 0, "Couldn't find a solution."
 
-        l1, l2 = curr_l1, curr_l2
+        return curr_l1, curr_l2
+
+    @staticmethod
+    def motion_blocks(dq_a, dq_b, check_axes=True):
+        """
+        Stack of the (N, 6, 8) per-motion row blocks of the calibration matrix T
+        from motions already converted to dual vector form.
+        """
+        a_vec_r, a_vec_d = dq_a.dqs[:, 1:4], dq_a.dqs[:, 5:]
+        b_vec_r, b_vec_d = dq_b.dqs[:, 1:4], dq_b.dqs[:, 5:]
+
+        if check_axes:
+            assert np.all(np.sum(a_vec_r * b_vec_r, axis=1) > 0), \
+                "Error! Screw axes are anti-parallel. Matrix rank is being reduced."
+
+        T = np.zeros((len(dq_a), 6, 8))
+        T[:, :3, 0] = a_vec_r - b_vec_r
+        T[:, :3, 1:4] = vec_to_skew_symmetric_mat(a_vec_r + b_vec_r)
+        T[:, 3:, 0] = a_vec_d - b_vec_d
+        T[:, 3:, 1:4] = vec_to_skew_symmetric_mat(a_vec_d + b_vec_d)
+        T[:, 3:, 4] = a_vec_r - b_vec_r
+        T[:, 3:, 5:] = vec_to_skew_symmetric_mat(a_vec_r + b_vec_r)
+        return T
+
+    @classmethod
+    def _blocks_from_arrays(cls, A, B, antiparallel_screw_axes=False, check_axes=True, screws=None):
+        dq_a, dq_b = cls.convert_to_dual_vectors(A, B, screws)
+
+        if antiparallel_screw_axes:
+            dq_rot1, dq_rot2 = _antiparallel_rotations()
+            dq_a = dq_rot1 * dq_a * dq_rot2
+
+        return cls.motion_blocks(dq_a, dq_b, check_axes)
+
+    def system_blocks(self, antiparallel_screw_axes=False, check_axes=True):
+        A, B = motions_as_arrays(self.motions)
+        return self._blocks_from_arrays(A, B, antiparallel_screw_axes, check_axes, self.screws)
+
+    def _check_weights(self, weights):
+        weights = np.asarray(weights, dtype=np.float64)
+        assert weights.shape == (len(self.motions),), "Expected {} motion weights, got shape {}.".format(
+            len(self.motions), weights.shape)
+        assert np.all(weights >= 0), "Motion weights must be non-negative."
+        return weights
+
+    @instrumentation.timed("normal_matrix")
+    def normal_matrix(self, antiparallel_screw_axes=False, chunk_size=4096, weights=None):
+        # Accumulate T^T T chunk by chunk so memory does not grow with the number of motions.
+        # With weights, motion i contributes weights[i] T_i^T T_i.
+        A, B = motions_as_arrays(self.motions)
+        instrumentation.count("motions", len(A))
+        TtT = np.zeros((8, 8))
+        for start in range(0, len(A), chunk_size):
+            stop = start + chunk_size
+            T = self._blocks_from_arrays(A[start:stop], B[start:stop], antiparallel_screw_axes,
+                                         screws=None if self.screws is None else self.screws[start:stop])
+            if weights is None:
+                TtT += np.einsum('nij,nik->jk', T, T)
+            else:
+                TtT += np.einsum('n,nij,nik->jk', weights[start:stop], T, T)
+        return TtT
+
+    @staticmethod
+    def normal_matrix_svd(TtT):
+        # The eigenvalues of T^T T are the squared singular values of T and its
+        # eigenvectors the right singular vectors. Returned in descending order like np.linalg.svd.
+        w, V = np.linalg.eigh(TtT)
+        return np.sqrt(np.clip(w[::-1], 0, None)), V[:, ::-1].T
+
+    def check_singular_values(self, s):
+        for i, sv in enumerate(s):
+            if i < 5:
+                assert sv > self.sv_limit, "Singular value {} was {} < the limit {}.".format(i, sv, self.sv_limit)
+            else:
+                # The last 3 singular values should be reasonably close to zero.
+                assert sv < self.sv_limit, "Singular value {} was {} > the limit {}.".format(i, sv, self.sv_limit)
+
+    @instrumentation.timed("solve_null_space")
+    def solve_null_space(self, v6, v7, antiparallel_screw_axes=False, symbolic=False):
+        u1 = v6[:4]
+        v1 = v6[4:]
+        u2 = v7[:4]
+        v2 = v7[4:]
+
+        if symbolic:
+            l1, l2 = self._solve_unity_constraints_symbolic(u1, v1, u2, v2)
+        else:
+            l1, l2 = self._solve_unity_constraints(u1, v1, u2, v2)
 
         dq_x = l1 * v6 + l2 * v7
         dq_x = DualQuaternion(dq_x[:4], dq_x[4:])
 
         if antiparallel_screw_axes:
-            dq_x = dq_rot2 * dq_x
+            dq_x = _antiparallel_rotations()[1] * dq_x
 
         return dq_x
 
+    @instrumentation.timed("solve_normal_matrix")
+    def solve_normal_matrix(self, TtT, antiparallel_screw_axes=False, symbolic=False):
+        s, Vt = self.normal_matrix_svd(TtT)
+        instrumentation.record("singular_values", s)
+
+        # Check that singular values are as expected.
+        self.check_singular_values(s)
+
+        # Rows are same as V column vectors
+        return self.solve_null_space(Vt[5], Vt[6], antiparallel_screw_axes, symbolic)
+
+    @instrumentation.timed("calibrate")
+    def calibrate(self, antiparallel_screw_axes=False, symbolic=False, dense_svd=False, weights=None):
+        # Optional non-negative per-motion weights scale each motion's squared residual.
+        if weights is not None:
+            weights = self._check_weights(weights)
+
+        if not dense_svd:
+            return self.solve_normal_matrix(self.normal_matrix(antiparallel_screw_axes, weights=weights),
+                                            antiparallel_screw_axes, symbolic)
+
+        # Reference path: SVD of the full 6N x 8 calibration matrix.
+        T = self.system_blocks(antiparallel_screw_axes)
+        if weights is not None:
+            T = T * np.sqrt(weights)[:, None, None]
+        T = T.reshape(-1, 8)
+        U, s, Vt = np.linalg.svd(T)
+        instrumentation.record("singular_values", s)
+
+        # Check that singular values are as expected.
+        self.check_singular_values(s)
+
+        # Rows are same as V column vectors
+        return self.solve_null_space(Vt[5], Vt[6], antiparallel_screw_axes, symbolic)
+
+    @staticmethod
+    def antiparallel_motions(blocks):
+        # Motions whose screw axes are anti-parallel, with 4 a.b = |a + b|^2 - |a - b|^2 taken
+        # from the rotation rows [a - b, [a + b]x] of each block built with check_axes=False.
+        a_dot_b = 0.5 * np.sum(blocks[:, :3, 1:4]**2, axis=(1, 2)) - np.sum(blocks[:, :3, 0]**2, axis=1)
+        return a_dot_b <= 0
+
+    @staticmethod
+    def motion_residuals(blocks, dq_x, antiparallel_screw_axes=False):
+        # ||T_i x|| for every motion, with x expressed in the frame the blocks were built in.
+        if antiparallel_screw_axes:
+            dq_x = _antiparallel_rotations()[0] * dq_x
+        return np.linalg.norm(np.matmul(blocks, dq_x.dq), axis=1)
+
+    @instrumentation.timed("calibrate_irls")
+    def calibrate_irls(self, antiparallel_screw_axes=False, loss="huber", scale=None, n_iterations=10, tol=1e-10,
+                       weights=None):
+        """
+        Robust calibration by iteratively reweighted least squares. Each iteration weights the
+        motions by the Huber or Cauchy loss of their residual ||T_i x|| against the current
+        estimate and re-solves. The per-motion 8x8 contributions T_i^T T_i are built once, so an
+        iteration only costs a weighted sum and an 8x8 eigendecomposition.
+
+        scale defaults to the normalized median absolute residual of each iteration. Optional
+        prior weights multiply the robust ones, and motions with anti-parallel screw axes get
+        zero weight instead of failing. Returns dq_x and the final motion weights.
+        """
+        assert loss in ("huber", "cauchy"), "Unknown IRLS loss {}.".format(loss)
+        prior = np.ones(len(self.motions)) if weights is None else self._check_weights(weights)
+
+        blocks = self.system_blocks(antiparallel_screw_axes, check_axes=False)
+        contributions = np.einsum('nij,nik->njk', blocks, blocks)
+
+        antiparallel = self.antiparallel_motions(blocks)
+        assert not antiparallel.all(), "Error! Screw axes of all motions are anti-parallel."
+        if antiparallel.any():
+            instrumentation.message("Ignoring {} motions with anti-parallel screw axes.".format(antiparallel.sum()))
+        prior = np.where(antiparallel, 0.0, prior)
+        weights = prior
+
+        # Gross outliers lift the null space singular values, so they are only checked on the final solve.
+        dq_x = self.solve_null_space(*self.normal_matrix_svd(np.tensordot(weights, contributions, axes=1))[1][5:7],
+                                     antiparallel_screw_axes)
+        for _ in range(n_iterations):
+            instrumentation.count("irls_iterations")
+            r = self.motion_residuals(blocks, dq_x, antiparallel_screw_axes)
+            sigma = scale if scale is not None else 1.4826 * np.median(r[prior > 0])
+            sigma = max(sigma, 1e-12)
+            if loss == "huber":
+                c = 1.345 * sigma
+                robust = np.where(r <= c, 1.0, c / np.maximum(r, 1e-300))
+            else:
+                c = 2.385 * sigma
+                robust = 1.0 / (1.0 + (r / c)**2)
+            previous, previous_weights = dq_x, weights
+            weights = prior * robust
+
+            # An iteration without a solution stops with the previous estimate.
+            try:
+                dq_x = self.solve_null_space(
+                    *self.normal_matrix_svd(np.tensordot(weights, contributions, axes=1))[1][5:7],
+                    antiparallel_screw_axes)
+            except AssertionError as e:
+                instrumentation.message("Stopping IRLS early: {}".format(e))
+                dq_x, weights = previous, previous_weights
+                break
+            # dq and -dq are the same transform.
+            if min(np.abs(dq_x.dq - previous.dq).max(), np.abs(dq_x.dq + previous.dq).max()) < tol:
+                break
+
+        dq_x = self.solve_normal_matrix(np.tensordot(weights, contributions, axes=1), antiparallel_screw_axes)
+        return dq_x, weights
+
+    @instrumentation.timed("calibrate_ransac")
+    def calibrate_ransac(self, antiparallel_screw_axes=False, n_hypotheses=200, sample_size=4, threshold=0.1,
+                         seed=0, time_budget=None, max_workers=None, hypothesis_sv_limit=None):
+        """
+        Robust calibration that solves n_hypotheses random subsets of sample_size motions
+        across a process pool, counts the motions whose residual ||T_i x|| is below
+        threshold for each hypothesis and refits on the inliers of the best one.
+
+        The per-motion row blocks are built once and handed to each worker when it starts.
+        Subsets are drawn up front from seed, so results are reproducible unless time_budget
+        (in seconds) cuts the search short, in which case the hypotheses scored so far are used.
+        Motions with anti-parallel screw axes are never sampled or counted as inliers. Singular
+        values of the small hypothesis systems are checked against hypothesis_sv_limit, by default
+        sv_limit scaled by sqrt(sample_size / n_motions). Returns dq_x and the boolean inlier mask.
+        """
+        # multiprocessing is only imported when a process pool is used.
+        from concurrent.futures import ProcessPoolExecutor
+
+        deadline = None if time_budget is None else time.time() + time_budget
+        blocks = self.system_blocks(antiparallel_screw_axes, check_axes=False)
+        contributions = np.einsum('nij,nik->njk', blocks, blocks)
+        antiparallel = self.antiparallel_motions(blocks)
+        valid = np.flatnonzero(~antiparallel)
+        n = len(valid)
+        if antiparallel.any():
+            instrumentation.message("Ignoring {} motions with anti-parallel screw axes.".format(antiparallel.sum()))
+
+        if hypothesis_sv_limit is None:
+            hypothesis_sv_limit = self.sv_limit * np.sqrt(sample_size / n)
+
+        instrumentation.count("ransac_hypotheses", n_hypotheses)
+        rng = np.random.default_rng(seed)
+        subsets = valid[_sample_subsets(rng, n, sample_size, n_hypotheses)]
+
+        scores = np.full((n_hypotheses, 2), [-1, np.inf])
+        chunks = np.array_split(np.arange(n_hypotheses), min(n_hypotheses, 4 * (max_workers or os.cpu_count() or 1)))
+
+        state = dict(blocks=blocks, contributions=contributions, antiparallel=antiparallel,
+                     sv_limit=hypothesis_sv_limit, antiparallel_screw_axes=antiparallel_screw_axes,
+                     threshold=threshold, deadline=deadline)
+        executor = ProcessPoolExecutor(max_workers=max_workers, initializer=_pool_init, initargs=(state,))
+        timed_out = False
+        try:
+            futures = {executor.submit(_ransac_score, subsets[chunk]): chunk for chunk in chunks}
+            # Workers stop at the deadline themselves, the grace period covers returning their scores.
+            timeout = None if deadline is None else max(deadline - time.time(), 0.0) + 1.0
+            for future in as_completed(futures, timeout=timeout):
+                chunk_scores = future.result()
+                if chunk_scores:
+                    scores[futures[future][:len(chunk_scores)]] = chunk_scores
+        except TimeoutError:
+            timed_out = True
+        finally:
+            executor.shutdown(wait=not timed_out, cancel_futures=True)
+
+        # Most inliers wins, ties go to the lower inlier residual and then the earlier hypothesis.
+        best = np.lexsort((np.arange(n_hypotheses), scores[:, 1], -scores[:, 0]))[0]
+        assert scores[best, 0] > 0, "No RANSAC hypothesis could be solved."
+
+        hypothesis = Calibrator4DOF([], hypothesis_sv_limit).solve_normal_matrix(
+            contributions[subsets[best]].sum(axis=0), antiparallel_screw_axes)
+        inliers = (self.motion_residuals(blocks, hypothesis, antiparallel_screw_axes) < threshold) & ~antiparallel
+
+        dq_x = self.solve_normal_matrix(contributions[inliers].sum(axis=0), antiparallel_screw_axes)
+        return dq_x, inliers
+
+    @instrumentation.timed("uncertainty")
+    def uncertainty(self, antiparallel_screw_axes=False, method="bootstrap", n_replicates=200, seed=0,
+                    percentiles=(2.5, 97.5), max_workers=None):
+        """
+        Bootstrap (or leave-one-out jackknife) uncertainty of the hand to camera translation x, y
+        and XYZ Euler angles in degrees. Each replicate reweights the precomputed per-motion 8x8
+        contributions (jackknife replicates subtract one from their sum) and re-solves, spread
+        across a process pool. Replicates that fail the
+        singular value checks are dropped and counted.
+        """
+        from concurrent.futures import ProcessPoolExecutor
+
+        assert method in ("bootstrap", "jackknife"), "Unknown uncertainty method {}.".format(method)
+        blocks = self.system_blocks(antiparallel_screw_axes)
+        contributions = np.einsum('nij,nik->njk', blocks, blocks)
+        n = len(contributions)
+        total = contributions.sum(axis=0)
+        estimate = _calibration_params(self.solve_normal_matrix(total, antiparallel_screw_axes))
+
+        if method == "jackknife":
+            solve, replicates = _jackknife_solve, np.arange(n)
+        else:
+            rng = np.random.default_rng(seed)
+            solve = _resample_solve
+            replicates = rng.multinomial(n, np.full(n, 1.0 / n), size=n_replicates).astype(np.float64)
+
+        chunks = np.array_split(replicates, min(len(replicates), 4 * (max_workers or os.cpu_count() or 1)))
+        state = dict(contributions=contributions, total=total, sv_limit=self.sv_limit,
+                     antiparallel_screw_axes=antiparallel_screw_axes)
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_pool_init, initargs=(state,)) as executor:
+            samples = np.vstack(list(executor.map(solve, chunks)))
+
+        failed = np.isnan(samples[:, 0])
+        samples = samples[~failed]
+        # Keep Euler angles on the same branch as the full estimate (e.g. around +-180deg).
+        samples[:, 2:] = estimate[2:] + (samples[:, 2:] - estimate[2:] + 180) % 360 - 180
+
+        if method == "jackknife":
+            deviation = samples - samples.mean(axis=0)
+            covariance = (len(samples) - 1) / len(samples) * deviation.T.dot(deviation)
+        else:
+            covariance = np.cov(samples, rowvar=False)
+
+        return {
+            "params": ["tx", "ty", "rx", "ry", "rz"],
+            "estimate": estimate,
+            "covariance": covariance,
+            "percentiles": {p: np.percentile(samples, p, axis=0) for p in percentiles},
+            "samples": samples,
+            "failed": int(failed.sum()),
+        }
+
     @staticmethod
-    def nonlinear_refinement(camera_to_marker, base_to_hand, calib_hand_to_camera):
+    def _refinement_targets(camera_to_marker, base_to_hand, calib_hand_to_camera):
+        base_to_hand = PoseSet(base_to_hand)
+        camera_to_marker = PoseSet(camera_to_marker)
+
+        # Each base to marker estimate, with inverses computed once up front.
+        base_to_marker = np.matmul(np.matmul(base_to_hand.transforms, calib_hand_to_camera), camera_to_marker.transforms)
+        return base_to_marker, base_to_hand.inverses, camera_to_marker.inverses
+
+    @staticmethod
+    @instrumentation.timed("nonlinear_refinement")
+    def nonlinear_refinement(camera_to_marker, base_to_hand, calib_hand_to_camera, method="least_squares"):
+        if method == "slsqp":
+            return Calibrator4DOF._nonlinear_refinement_slsqp(camera_to_marker, base_to_hand, calib_hand_to_camera)
+
+        # We just use an arbitrary pose as our initial guess.
+        targets = Calibrator4DOF._refinement_targets(camera_to_marker, base_to_hand, calib_hand_to_camera)
+        return _refine_from_seed(*targets, seed=0)[0]
+
+    @staticmethod
+    @instrumentation.timed("nonlinear_refinement_multistart")
+    def nonlinear_refinement_multistart(camera_to_marker, base_to_hand, calib_hand_to_camera, n_starts=4,
+                                        max_workers=None, cost_threshold=None, use_processes=False):
+        """
+        Run nonlinear_refinement from n_starts diverse seed poses in a thread (or process) pool
+        and keep the lowest cost result. As soon as one start reaches cost_threshold, pending
+        starts are cancelled and running ones stop at their next objective evaluation. Returns
+        the refined hand to camera transform and a list of {"seed", "cost", "time"} entries for
+        every start that ran, with a None cost for the stopped ones.
+        """
+        from concurrent.futures import ProcessPoolExecutor
+
+        targets = Calibrator4DOF._refinement_targets(camera_to_marker, base_to_hand, calib_hand_to_camera)
+        seeds = _diverse_seeds(targets[0], n_starts)
+
+        manager, stop = None, None
+        if cost_threshold is not None:
+            if use_processes:
+                # Worker processes share the stop event through a manager.
+                from multiprocessing import Manager
+                manager = Manager()
+            stop = threading.Event() if manager is None else manager.Event()
+
+        executor = (ProcessPoolExecutor if use_processes else ThreadPoolExecutor)(max_workers=max_workers)
+        try:
+            futures = [executor.submit(_refine_from_seed, *targets, seed=seed, stop=stop) for seed in seeds]
+            for future in as_completed(futures):
+                if cost_threshold is not None and future.result()[1] <= cost_threshold:
+                    stop.set()
+                    break
+        finally:
+            # Pending starts are cancelled, running ones return at their next evaluation.
+            executor.shutdown(wait=True, cancel_futures=True)
+            if manager is not None:
+                manager.shutdown()
+        results = [f.result() for f in futures if not f.cancelled()]
+
+        best = min((r for r in results if r[1] is not None), key=lambda r: r[1])
+        report = [{"seed": seed, "cost": cost, "time": elapsed} for _, cost, seed, elapsed in results]
+        return best[0], report
+
+    @staticmethod
+    def _nonlinear_refinement_slsqp(camera_to_marker, base_to_hand, calib_hand_to_camera):
+        from scipy.optimize import minimize
+
         # We only vary the first 11 parameters of the transform matrix since we cannot solve for tz.
         W = np.eye(4)
         W[-1, -1] = 9
@@ -122,8 +691,9 @@ class Calibrator4DOF:
         # We just use an arbitrary pose as our initial guess.
         x0 = (base_to_hand[0].dot(calib_hand_to_camera).dot(camera_to_marker[0])).ravel()[:11]
 
-        nl_base_to_marker = obtain_tf_from_rolled_arr(minimize(base_to_marker_error, x0,
-                                                               constraints=rotation_matrix_constraints()).x)
+        result = minimize(base_to_marker_error, x0, constraints=rotation_matrix_constraints())
+        instrumentation.count("objective_evaluations", result.nfev)
+        nl_base_to_marker = obtain_tf_from_rolled_arr(result.x)
 
         # Now that we optimized to obtain base to marker transform, we perform the optimization
         # once more to regain the hand to camera transform (the one we care about).
@@ -139,7 +709,8 @@ class Calibrator4DOF:
 
         x0 = (np.linalg.inv(base_to_hand[0]).dot(nl_base_to_marker).dot(np.linalg.inv(camera_to_marker[0]))).ravel()[:11]
 
-        nl_hand_to_camera = obtain_tf_from_rolled_arr(minimize(hand_to_camera_error, x0,
-                                                               constraints=rotation_matrix_constraints()).x)
+        result = minimize(hand_to_camera_error, x0, constraints=rotation_matrix_constraints())
+        instrumentation.count("objective_evaluations", result.nfev)
+        nl_hand_to_camera = obtain_tf_from_rolled_arr(result.x)
 
         return nl_hand_to_camera
@@ -1,97 +1,274 @@
 import numpy as np
-from .quaternions import Quaternion
+from .quaternions import Quaternion, QuaternionArray, quat_multiply, quat_conjugate, quat_as_axis_angle
 from .utils import matrix_to_quat, quat_to_matrix
 
 
+# Dual quaternions are stored as 8-vectors [real (wxyz), dual (wxyz)].
+# The functions below broadcast over any leading axes so that the scalar
+# and batched classes share the same arithmetic.
+
+def dq_multiply(dq1, dq2):
+    r1, d1 = dq1[..., :4], dq1[..., 4:]
+    r2, d2 = dq2[..., :4], dq2[..., 4:]
+    return np.concatenate((quat_multiply(r1, r2),
+                           quat_multiply(r1, d2) + quat_multiply(d1, r2)), axis=-1)
+
+
+def dq_normalize(dq):
+    return dq / np.linalg.norm(dq[..., :4], axis=-1, keepdims=True)
+
+
+def dq_conjugate1(dq):
+    return dq * [1, -1, -1, -1, 1, -1, -1, -1]
+
+
+def dq_conjugate2(dq):
+    return dq * [1, 1, 1, 1, -1, -1, -1, -1]
+
+
+def dq_conjugate3(dq):
+    return dq * [1, -1, -1, -1, -1, 1, 1, 1]
+
+
+def dq_translation_to_dual(trans, real):
+    trans = np.asarray(trans, dtype=np.float64)
+    vec = np.zeros(trans.shape[:-1] + (4,), dtype=np.float64)
+    vec[..., 1:] = trans
+    return quat_multiply(0.5 * vec, real)
+
+
+def dq_from_pose(position, quat_rot):
+    real = np.asarray(quat_rot, dtype=np.float64)
+    return dq_normalize(np.concatenate((real, dq_translation_to_dual(position, real)), axis=-1))
+
+
+def dq_from_transform(tf):
+    tf = np.asarray(tf, dtype=np.float64)
+    return dq_from_pose(tf[..., :3, -1], matrix_to_quat(tf[..., :3, :3]))
+
+
+def dq_get_translation(dq):
+    return 2 * quat_multiply(dq[..., 4:], quat_conjugate(dq[..., :4]))[..., 1:]
+
+
+def dq_as_screw_params(dq):
+    axis, theta = quat_as_axis_angle(dq[..., :4])
+    translation = dq_get_translation(dq)
+
+    d = np.sum(translation * axis, axis=-1)
+    moment = 0.5 * (np.cross(translation, axis) +
+                    (translation - d[..., None] * axis) / np.tan(0.5 * theta)[..., None])
+    return axis, d, moment, theta
+
+
+def dq_as_transform(dq):
+    tf = np.zeros(dq.shape[:-1] + (4, 4), dtype=np.float64)
+    tf[..., :3, :3] = quat_to_matrix(dq[..., :4])
+    tf[..., :3, -1] = dq_get_translation(dq)
+    tf[..., -1, -1] = 1
+    return tf
+
+
 class DualQuaternion:
     def __init__(self, real_quat, dual_quat):
-        self.real = Quaternion(real_quat) if not isinstance(real_quat, Quaternion) else real_quat
-        self.dual = Quaternion(dual_quat) if not isinstance(dual_quat, Quaternion) else dual_quat
+        self.dq = np.empty(8, dtype=np.float64)
+        self.dq[:4] = real_quat.quat if isinstance(real_quat, Quaternion) else real_quat
+        self.dq[4:] = dual_quat.quat if isinstance(dual_quat, Quaternion) else dual_quat
         self.normalize()
 
+    @classmethod
+    def _view(cls, dq, normalize=False):
+        # Wrap an existing length 8 array without copying it.
+        obj = cls.__new__(cls)
+        obj.dq = dq
+        if normalize:
+            obj.normalize()
+        return obj
+
+    def __setstate__(self, state):
+        # Motions pickled before the array-backed layout store separate quaternions.
+        if 'dq' not in state:
+            state = {'dq': np.hstack((state['real'].quat, state['dual'].quat))}
+        self.__dict__.update(state)
+
+    @property
+    def real(self):
+        return Quaternion._view(self.dq[:4])
+
+    @property
+    def dual(self):
+        return Quaternion._view(self.dq[4:])
+
     @classmethod
     def from_pose(cls, position, quat_rot):
-        real_quat = Quaternion(quat_rot) if not isinstance(quat_rot, Quaternion) else quat_rot
-        dual_quat = DualQuaternion.translation_to_dual(position, real_quat)
-        return cls(real_quat, dual_quat)
+        real_quat = quat_rot.quat if isinstance(quat_rot, Quaternion) else quat_rot
+        return cls._view(dq_from_pose(position, real_quat))
 
     @classmethod
     def from_transform(cls, tf):
-        real_quat = Quaternion(matrix_to_quat(tf[:3, :3]))
-        dual_quat = DualQuaternion.translation_to_dual(tf[:3, -1], real_quat)
-        return cls(real_quat, dual_quat)
+        return cls._view(dq_from_transform(tf))
 
     @classmethod
     def from_dual_vector(cls, line_axis, moment):
         return cls(np.hstack(([0], line_axis)), np.hstack(([0], moment)))
 
     def __add__(self, other):
-        new_real = self.real + other.real
-        new_dual = self.dual + other.dual
-        return DualQuaternion(new_real, new_dual)
+        return DualQuaternion._view(self.dq + other.dq, normalize=True)
 
     def __neg__(self):
-        return DualQuaternion(-self.real, -self.dual)
+        return DualQuaternion._view(-self.dq, normalize=True)
 
     def __mul__(self, other):
         if isinstance(other, DualQuaternion):
-            new_real = self.real * other.real
-            new_dual = self.real * other.dual + self.dual * other.real
-            return DualQuaternion(new_real, new_dual)
-        return DualQuaternion(other * self.real, other * self.dual)
+            return DualQuaternion._view(dq_multiply(self.dq, other.dq), normalize=True)
+        if isinstance(other, DualQuaternionArray):
+            return DualQuaternionArray._view(dq_normalize(dq_multiply(self.dq, other.dqs)))
+        return DualQuaternion._view(other * self.dq, normalize=True)
 
     def __rmul__(self, other):
-        return DualQuaternion(other * self.real, other * self.dual)
+        return DualQuaternion._view(other * self.dq, normalize=True)
 
     def __str__(self):
-        return str(list(self.real.quat) + list(self.dual.quat))
+        return str(list(self.dq))
 
     def dq_conjugate1(self):
         """
         D* = D0* + eD1*
         """
-        return DualQuaternion(self.real.conjugate(), self.dual.conjugate())
+        return DualQuaternion._view(dq_conjugate1(self.dq), normalize=True)
 
     def dq_conjugate2(self):
         """
         D* = D0 - eD1
         """
-        return DualQuaternion(self.real, -self.dual)
+        return DualQuaternion._view(dq_conjugate2(self.dq), normalize=True)
 
     def dq_conjugate3(self):
         """
         D* = D0* - eD1*
         """
-        return DualQuaternion(self.real.conjugate(), -self.dual.conjugate())
+        return DualQuaternion._view(dq_conjugate3(self.dq), normalize=True)
 
     def normalize(self):
-        real_norm = np.linalg.norm(self.real.quat)
-        self.real.quat /= real_norm
-        self.dual.quat /= real_norm
+        self.dq /= np.linalg.norm(self.dq[:4])
 
     def get_translation(self):
-        return (2 * (self.dual * self.real.conjugate())).quat[1:]
+        return dq_get_translation(self.dq)
 
     def get_rotation(self):
-        return quat_to_matrix(self.real.quat)
+        return quat_to_matrix(self.dq[:4])
 
     @staticmethod
     def translation_to_dual(trans, real):
-        vec = np.zeros(4, dtype=np.float64)
-        vec[1:] = trans
-        return 0.5 * Quaternion(vec) * real
+        real = real.quat if isinstance(real, Quaternion) else real
+        return Quaternion._view(dq_translation_to_dual(trans, real))
 
     def as_screw_params(self):
-        axis, theta = self.real.as_axis_angle()
-        translation = self.get_translation()
+        axis, d, moment, theta = dq_as_screw_params(self.dq)
+        return axis, float(d), moment, float(theta)
+
+    def as_transform(self):
+        return dq_as_transform(self.dq)
+
+
+class DualQuaternionArray:
+    """
+    Batch of N dual quaternions stored as a single contiguous (N, 8) array.
+    Indexing with an integer returns a DualQuaternion that views the underlying row.
+    """
+    def __init__(self, dqs, normalize=True):
+        self.dqs = np.array(dqs, dtype=np.float64).reshape(-1, 8)
+        if normalize:
+            self.normalize()
+
+    @classmethod
+    def _view(cls, dqs):
+        obj = cls.__new__(cls)
+        obj.dqs = dqs
+        return obj
+
+    @classmethod
+    def from_list(cls, dqs):
+        return cls._view(np.array([dq.dq for dq in dqs], dtype=np.float64).reshape(-1, 8))
 
-        d = translation.dot(axis)
-        moment = 0.5 * (np.cross(translation, axis) + (translation - d * axis) / np.tan(0.5 * theta))
-        return axis, d, moment, theta
+    @classmethod
+    def from_pose(cls, positions, quat_rots):
+        return cls._view(dq_from_pose(positions, quat_rots))
+
+    @classmethod
+    def from_transform(cls, tfs):
+        return cls._view(dq_from_transform(tfs).reshape(-1, 8))
+
+    @classmethod
+    def from_dual_vector(cls, line_axes, moments):
+        line_axes = np.asarray(line_axes, dtype=np.float64)
+        dqs = np.zeros((len(line_axes), 8), dtype=np.float64)
+        dqs[:, 1:4] = line_axes
+        dqs[:, 5:] = moments
+        return cls(dqs)
+
+    @property
+    def real(self):
+        return QuaternionArray(self.dqs[:, :4])
+
+    @property
+    def dual(self):
+        return QuaternionArray(self.dqs[:, 4:])
+
+    def __len__(self):
+        return len(self.dqs)
+
+    def __getitem__(self, item):
+        if isinstance(item, (int, np.integer)):
+            return DualQuaternion._view(self.dqs[item])
+        return DualQuaternionArray._view(self.dqs[item])
+
+    def __iter__(self):
+        for dq in self.dqs:
+            yield DualQuaternion._view(dq)
+
+    def __add__(self, other):
+        return DualQuaternionArray(self.dqs + other.dqs)
+
+    def __neg__(self):
+        return DualQuaternionArray(-self.dqs)
+
+    def __mul__(self, other):
+        if isinstance(other, DualQuaternionArray):
+            return DualQuaternionArray._view(dq_normalize(dq_multiply(self.dqs, other.dqs)))
+        if isinstance(other, DualQuaternion):
+            return DualQuaternionArray._view(dq_normalize(dq_multiply(self.dqs, other.dq)))
+        return self.__rmul__(other)
+
+    def __rmul__(self, other):
+        return DualQuaternionArray(np.multiply(np.asarray(other)[..., None], self.dqs))
+
+    def __str__(self):
+        return str(self.dqs)
+
+    def dq_conjugate1(self):
+        return DualQuaternionArray(dq_conjugate1(self.dqs))
+
+    def dq_conjugate2(self):
+        return DualQuaternionArray(dq_conjugate2(self.dqs))
+
+    def dq_conjugate3(self):
+        return DualQuaternionArray(dq_conjugate3(self.dqs))
+
+    def normalize(self):
+        self.dqs /= np.linalg.norm(self.dqs[:, :4], axis=-1, keepdims=True)
+
+    def get_translation(self):
+        return dq_get_translation(self.dqs)
+
+    def get_rotation(self):
+        return quat_to_matrix(self.dqs[:, :4])
+
+    def as_axis_angle(self):
+        return quat_as_axis_angle(self.dqs[:, :4])
+
+    def as_screw_params(self):
+        return dq_as_screw_params(self.dqs)
 
     def as_transform(self):
-        tf = np.zeros((4, 4), dtype=np.float64)
-        tf[:3, :3] = quat_to_matrix(self.real.quat)
-        tf[:3, -1] = self.get_translation()
-        tf[-1, -1] = 1
-        return tf
+        return dq_as_transform(self.dqs)
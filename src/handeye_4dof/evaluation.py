@@ -0,0 +1,160 @@
+"""
+Accuracy evaluation of a hand to camera calibration X on pose pairs
+(base_to_hand H_i, camera_to_marker C_i), where every H_i X C_i is the same
+base to marker transform M.
+
+consistency_errors: distance of every H_i X C_i from their mean, the quantity
+                    nonlinear_refinement minimizes.
+ax_xb_residuals:    AX = XB residuals of pose pairs (i, j) with A = H_j^-1 H_i and B = C_j C_i^-1.
+cross_validate:     k-fold cross-validation of Calibrator4DOF, scoring every held-out pose.
+
+Translation errors are in meters and rotation errors in radians.
+"""
+
+import os
+import numpy as np
+from . import instrumentation
+from .calibrator import Calibrator4DOF, _pool_init, _pool_state
+from .pose_selector import robot_pose_selector
+from .pose_set import PoseSet
+
+
+def _rotation_angles(R):
+    # Rotation angle of every (..., 3, 3) rotation matrix.
+    cos = (np.trace(R, axis1=-2, axis2=-1) - 1) / 2
+    return np.arccos(np.clip(cos, -1.0, 1.0))
+
+
+def _mean_transform(transforms):
+    # Chordal L2 mean rotation (projection of the mean matrix onto SO(3)) and median translation.
+    U, _, Vt = np.linalg.svd(transforms[:, :3, :3].mean(axis=0))
+    D = np.diag([1, 1, np.sign(np.linalg.det(U.dot(Vt)))])
+    mean = np.eye(4)
+    mean[:3, :3] = U.dot(D).dot(Vt)
+    mean[:3, -1] = np.median(transforms[:, :3, -1], axis=0)
+    return mean
+
+
+def base_to_marker_estimates(camera_to_marker, base_to_hand, hand_to_camera):
+    return np.matmul(np.matmul(PoseSet(base_to_hand).transforms, hand_to_camera), PoseSet(camera_to_marker).transforms)
+
+
+def consistency_errors(camera_to_marker, base_to_hand, hand_to_camera, base_to_marker=None):
+    """
+    Per pose translation and rotation error of H_i X C_i against base_to_marker, by default
+    their mean. Returns (translation_errors, rotation_errors, base_to_marker).
+    """
+    estimates = base_to_marker_estimates(camera_to_marker, base_to_hand, hand_to_camera)
+    if base_to_marker is None:
+        base_to_marker = _mean_transform(estimates)
+
+    translation = np.linalg.norm(estimates[:, :3, -1] - base_to_marker[:3, -1], axis=-1)
+    rotation = _rotation_angles(np.matmul(base_to_marker[:3, :3].T, estimates[:, :3, :3]))
+    return translation, rotation, base_to_marker
+
+
+def ax_xb_residuals(camera_to_marker, base_to_hand, hand_to_camera, pairs=None):
+    """
+    Translation and rotation residuals of A X = X B for the (M, 2) pose index pairs,
+    by default consecutive poses. Returns (pairs, translation_residuals, rotation_residuals).
+    """
+    base_to_hand, camera_to_marker = PoseSet(base_to_hand), PoseSet(camera_to_marker)
+    n = len(base_to_hand)
+    pairs = np.column_stack((np.arange(n - 1), np.arange(1, n))) if pairs is None else np.asarray(pairs)
+    i, j = pairs[:, 0], pairs[:, 1]
+
+    A = np.matmul(base_to_hand.inverses[j], base_to_hand.transforms[i])
+    B = np.matmul(camera_to_marker.transforms[j], camera_to_marker.inverses[i])
+    AX = np.matmul(A, hand_to_camera)
+    XB = np.matmul(hand_to_camera, B)
+
+    translation = np.linalg.norm(AX[:, :3, -1] - XB[:, :3, -1], axis=-1)
+    rotation = _rotation_angles(np.matmul(AX[:, :3, :3].transpose(0, 2, 1), XB[:, :3, :3]))
+    return pairs, translation, rotation
+
+
+def _summary(errors):
+    return {"mean": float(np.mean(errors)), "rms": float(np.sqrt(np.mean(errors**2))),
+            "median": float(np.median(errors)), "max": float(np.max(errors))}
+
+
+@instrumentation.timed("evaluate")
+def evaluate(camera_to_marker, base_to_hand, hand_to_camera, n_worst=10):
+    """
+    Consistency errors and consecutive-pose AX = XB residuals with summary statistics
+    and the indices of the n_worst poses by translation consistency error.
+    """
+    translation, rotation, base_to_marker = consistency_errors(camera_to_marker, base_to_hand, hand_to_camera)
+    pairs, ax_translation, ax_rotation = ax_xb_residuals(camera_to_marker, base_to_hand, hand_to_camera)
+    return {
+        "base_to_marker": base_to_marker,
+        "translation_errors": translation,
+        "rotation_errors": rotation,
+        "translation": _summary(translation),
+        "rotation": _summary(rotation),
+        "ax_xb_translation": _summary(ax_translation),
+        "ax_xb_rotation": _summary(ax_rotation),
+        "worst_poses": np.argsort(translation)[::-1][:n_worst],
+    }
+
+
+def _cross_validate_fold(test):
+    state = _pool_state
+    train = np.setdiff1d(np.arange(len(state["base_to_hand"])), test)
+    base_to_hand, camera_to_marker = state["base_to_hand"][train], state["camera_to_marker"][train]
+
+    motions = robot_pose_selector(camera_to_marker, base_to_hand)
+    cb = Calibrator4DOF(motions, state["sv_limit"])
+    hand_to_camera = np.linalg.inv(cb.calibrate(state["antiparallel_screw_axes"]).as_transform())
+    if state["nonlinear"]:
+        hand_to_camera = cb.nonlinear_refinement(camera_to_marker, base_to_hand, hand_to_camera)
+
+    # The base to marker transform is estimated from the training poses only.
+    _, _, base_to_marker = consistency_errors(camera_to_marker, base_to_hand, hand_to_camera)
+    translation, rotation, _ = consistency_errors(state["camera_to_marker"][test], state["base_to_hand"][test],
+                                                  hand_to_camera, base_to_marker)
+    return hand_to_camera, translation, rotation
+
+
+@instrumentation.timed("cross_validate")
+def cross_validate(camera_to_marker, base_to_hand, k=5, antiparallel_screw_axes=False, nonlinear=False,
+                   sv_limit=0.5, seed=0, max_workers=None):
+    """
+    k-fold cross-validation over poses. Each fold selects motions from and calibrates on the
+    remaining poses in a process pool, then scores its held-out poses by their consistency
+    error against the training base to marker estimate. Every pose is held out exactly once.
+    Folds that fail the calibrate() assertions leave NaN errors for their poses.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    base_to_hand = PoseSet(base_to_hand).transforms
+    camera_to_marker = PoseSet(camera_to_marker).transforms
+    n = len(base_to_hand)
+    assert 2 <= k <= n, "Need 2 <= k <= {} folds, got {}.".format(n, k)
+
+    folds = np.array_split(np.random.default_rng(seed).permutation(n), k)
+    translation, rotation = np.full(n, np.nan), np.full(n, np.nan)
+    transforms = [None for _ in range(k)]
+
+    state = dict(base_to_hand=base_to_hand, camera_to_marker=camera_to_marker, sv_limit=sv_limit,
+                 antiparallel_screw_axes=antiparallel_screw_axes, nonlinear=nonlinear)
+    with ProcessPoolExecutor(max_workers=min(k, max_workers or os.cpu_count() or 1), initializer=_pool_init,
+                             initargs=(state,)) as executor:
+        futures = [executor.submit(_cross_validate_fold, test) for test in folds]
+        for f, (test, future) in enumerate(zip(folds, futures)):
+            try:
+                transforms[f], translation[test], rotation[test] = future.result()
+            except AssertionError as e:
+                instrumentation.count("cross_validation_failed_folds")
+                instrumentation.message("Fold {} failed: {}".format(f, e))
+
+    valid = ~np.isnan(translation)
+    return {
+        "folds": folds,
+        "hand_to_camera": transforms,
+        "translation_errors": translation,
+        "rotation_errors": rotation,
+        "translation": _summary(translation[valid]) if valid.any() else None,
+        "rotation": _summary(rotation[valid]) if valid.any() else None,
+        "worst_poses": np.argsort(np.where(valid, translation, -np.inf))[::-1][:10],
+    }
@@ -0,0 +1,75 @@
+from collections import deque
+import numpy as np
+from .calibrator import Calibrator4DOF
+from .dual_quaternions import DualQuaternionArray
+
+
+class IncrementalCalibrator4DOF(Calibrator4DOF):
+    """
+    Calibrator for motions arriving as a stream. The 8x8 normal matrix T^T T is
+    kept as a running sum of per-motion contributions, so adding or removing a
+    motion and re-solving costs the same regardless of how many motions were seen.
+
+    If window_size is given, only the most recent window_size motions are used.
+    """
+    def __init__(self, window_size=None, sv_limit=0.5, antiparallel_screw_axes=False):
+        super().__init__(deque(), sv_limit)
+        self.window_size = window_size
+        self.antiparallel_screw_axes = antiparallel_screw_axes
+        self.dq_x = None
+        # (x, y translation, rotation angle) change between the last two estimates.
+        self.drift = None
+        self._contributions = deque()
+        self._TtT = np.zeros((8, 8))
+        self._removals = 0
+
+    def add_motion(self, A, B):
+        T = self._blocks_from_arrays(DualQuaternionArray.from_list([A]), DualQuaternionArray.from_list([B]),
+                                     self.antiparallel_screw_axes)[0]
+        contribution = T.T.dot(T)
+        self.motions.append((A, B))
+        self._contributions.append(contribution)
+        self._TtT += contribution
+
+        if self.window_size is not None and len(self.motions) > self.window_size:
+            self.remove_motion(0)
+
+    def remove_motion(self, index=0):
+        motion = self.motions[index]
+        contribution = self._contributions[index]
+        del self.motions[index]
+        del self._contributions[index]
+        self._TtT -= contribution
+
+        # Resum from scratch every so often to stop rounding error from accumulating.
+        self._removals += 1
+        if self._removals >= max(len(self._contributions), 1):
+            self._TtT = np.sum(self._contributions, axis=0) if self._contributions else np.zeros((8, 8))
+            self._removals = 0
+
+        return motion
+
+    def normal_matrix(self, antiparallel_screw_axes=False, chunk_size=4096, weights=None):
+        if antiparallel_screw_axes != self.antiparallel_screw_axes:
+            return super().normal_matrix(antiparallel_screw_axes, chunk_size, weights)
+        if weights is not None:
+            return np.tensordot(weights, np.asarray(self._contributions), axes=1)
+        return self._TtT.copy()
+
+    def update(self, symbolic=False):
+        """
+        Re-solve for dq_x from the current motions and record the drift from the
+        previous estimate. Raises the usual calibrate() assertions while there are
+        too few motions to constrain the solution.
+        """
+        dq_x = self.calibrate(self.antiparallel_screw_axes, symbolic=symbolic)
+
+        if self.dq_x is not None:
+            # tz is not observable, only the x, y translation of the hand to camera transform is compared.
+            translation = np.linalg.norm(np.linalg.inv(dq_x.as_transform())[:2, -1] -
+                                         np.linalg.inv(self.dq_x.as_transform())[:2, -1])
+            cos_half = np.clip(abs(dq_x.real.quat.dot(self.dq_x.real.quat)), 0.0, 1.0)
+            self.drift = (float(translation), float(2 * np.arccos(cos_half)))
+
+        self.dq_x = dq_x
+        return dq_x
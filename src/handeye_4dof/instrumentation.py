@@ -0,0 +1,100 @@
+import functools
+import logging
+import time
+from contextlib import contextmanager
+import numpy as np
+
+
+logger = logging.getLogger("handeye_4dof")
+
+
+class Instrumentation:
+    """
+    Collects per-stage wall/CPU timings, counters and recorded values (such as singular
+    values) from the package. Every event is also passed to the registered callbacks as
+    callback(kind, name, payload) with kind one of "stage", "count", "record" or "message".
+    """
+    def __init__(self, callbacks=None):
+        self.callbacks = list(callbacks or [])
+        self.stages = {}
+        self.counters = {}
+        self.values = {}
+
+    def _emit(self, kind, name, payload):
+        for callback in self.callbacks:
+            callback(kind, name, payload)
+
+    @contextmanager
+    def stage(self, name):
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+            stats = self.stages.setdefault(name, {"calls": 0, "wall_s": 0.0, "cpu_s": 0.0})
+            stats["calls"] += 1
+            stats["wall_s"] += wall
+            stats["cpu_s"] += cpu
+            logger.debug("%s took %.6fs (cpu %.6fs)", name, wall, cpu)
+            self._emit("stage", name, {"wall_s": wall, "cpu_s": cpu})
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + int(n)
+        self._emit("count", name, int(n))
+
+    def record(self, name, value):
+        value = np.asarray(value).tolist()
+        self.values[name] = value
+        self._emit("record", name, value)
+
+    def message(self, msg):
+        logger.info(msg)
+        self._emit("message", None, msg)
+
+    def report(self):
+        return {"stages": self.stages, "counters": self.counters, "values": self.values}
+
+
+_current = Instrumentation()
+
+
+def get_instrumentation():
+    return _current
+
+
+@contextmanager
+def use_instrumentation(instrumentation):
+    # Route the package's instrumentation to the given instance within the block.
+    global _current
+    previous, _current = _current, instrumentation
+    try:
+        yield instrumentation
+    finally:
+        _current = previous
+
+
+def stage(name):
+    return _current.stage(name)
+
+
+def count(name, n=1):
+    _current.count(name, n)
+
+
+def record(name, value):
+    _current.record(name, value)
+
+
+def message(msg):
+    _current.message(msg)
+
+
+def timed(name):
+    # Decorator running the wrapped function as a stage of the current instrumentation.
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -1,31 +1,166 @@
 import pickle
 import numpy as np
-from .dual_quaternions import DualQuaternion
+from . import instrumentation
+from .calibrator import Calibrator4DOF, motions_as_arrays
+from .dual_quaternions import DualQuaternionArray
+from .pose_set import PoseSet
 
 
-def robot_pose_selector(tf1, tf2):
+def _pairwise_rotation_angles(quats_i, quats):
+    # Rotation angle of qj * qi^-1 for every (i, j) pair, which equals the
+    # angle of both Aj * Ai^-1 and Bj^-1 * Bi.
+    cos_half = np.clip(np.abs(quats_i.dot(quats.T)), 0.0, 1.0)
+    return 2 * np.arccos(cos_half)
+
+
+def _exact_partners(q1, q2, max_block_bytes):
+    n = len(q1)
+    # Each block holds a few (rows, n) float64 temporaries.
+    block = int(max(1, max_block_bytes // (4 * 8 * max(n, 1))))
+
+    instrumentation.count("pairs_evaluated", n * (n - 1))
+    partners = np.full(n, -1)
+    for start in range(0, n, block):
+        stop = min(start + block, n)
+        theta_sum = _pairwise_rotation_angles(q1[start:stop], q1) + _pairwise_rotation_angles(q2[start:stop], q2)
+        rows = np.arange(stop - start)
+        theta_sum[rows, rows + start] = -np.inf
+
+        # Obtain motions with maximal screw angles.
+        best = np.argmax(theta_sum, axis=1)
+        found = theta_sum[rows, best] > 0
+        partners[start:stop][found] = best[found]
+
+    return partners
+
+
+def _dominant_yaw(quats):
+    # Rotations about a single axis trace a great circle on the unit quaternion
+    # sphere. The two leading eigenvectors of Q^T Q span that circle (and are
+    # invariant to the q / -q sign ambiguity), so the position on the circle
+    # gives the rotation angle about the dominant axis.
+    _, vecs = np.linalg.eigh(quats.T.dot(quats))
+    e1, e2 = vecs[:, -1], vecs[:, -2]
+    return 2 * np.arctan2(quats.dot(e2), quats.dot(e1)) % (2 * np.pi)
+
+
+def _indexed_partners(q1, q2, window):
+    n = len(q1)
+    yaw = _dominant_yaw(q1)
+    order = np.argsort(yaw)
+
+    # The maximal-angle partner sits roughly opposite on the yaw circle, so only
+    # a few neighbours of the antipodal yaw are scored exactly.
+    pos = np.searchsorted(yaw[order], (yaw + np.pi) % (2 * np.pi))
+    offsets = np.arange(-window, window)
+    cands = order[(pos[:, None] + offsets) % n]
+    instrumentation.count("pairs_evaluated", cands.size)
+
+    theta_sum = (2 * np.arccos(np.clip(np.abs(np.einsum('ij,ikj->ik', q1, q1[cands])), 0.0, 1.0)) +
+                 2 * np.arccos(np.clip(np.abs(np.einsum('ij,ikj->ik', q2, q2[cands])), 0.0, 1.0)))
+    theta_sum[cands == np.arange(n)[:, None]] = -np.inf
+
+    rows = np.arange(n)
+    best = np.argmax(theta_sum, axis=1)
+    return np.where(theta_sum[rows, best] > 0, cands[rows, best], -1)
+
+
+def _build_motions(ps1, ps2, partners):
+    motions = [None for _ in range(len(ps1))]
+    idx = np.flatnonzero(partners >= 0)
+    if len(idx):
+        j = partners[idx]
+        A = DualQuaternionArray.from_transform(np.matmul(ps1[j], ps1.inverses[idx]))
+        B = DualQuaternionArray.from_transform(np.matmul(ps2.inverses[j], ps2[idx]))
+        for k, i in enumerate(idx):
+            motions[i] = (A[k], B[k])
+    return motions
+
+
+@instrumentation.timed("indexed_select_motions")
+def indexed_robot_pose_selector(tf1, tf2, window=4, n_validate=200, seed=0):
+    """
+    Approximate robot_pose_selector in O(N log N) for 4DOF arms, whose relative
+    rotations are dominated by yaw about a single axis. Poses are sorted by yaw
+    and only the 2 * window poses closest to the opposite yaw are scored.
+
+    The picks of up to n_validate randomly sampled poses are checked against the
+    exact selector and summarised in the returned report.
+    """
     assert len(tf1) == len(tf2), "Nonmatching number of transforms."
-    motions = [None for _ in range(len(tf1))]
-    for i, (Ai, Bi) in enumerate(zip(tf1, tf2)):
-        print("Obtaining motion {}...".format(i+1))
-        curr_theta_max = 0
-        for j, (Aj, Bj) in enumerate(zip(tf1, tf2)):
-            if i == j: continue
-            A = DualQuaternion.from_transform(np.dot(Aj, np.linalg.inv(Ai)))
-            B = DualQuaternion.from_transform(np.dot(np.linalg.inv(Bj), Bi))
-            theta1 = A.as_screw_params()[-1]
-            theta2 = B.as_screw_params()[-1]
-
-            # Obtain motions with maximal screw angles.
-            theta_sum = np.sum(np.abs([theta1, theta2]))
-            if theta_sum > curr_theta_max:
-                curr_theta_max = theta_sum
-                motions[i] = (A, B)
-
-    print("Obtained a total of {} motions.".format(len(motions)))
+    ps1, ps2 = PoseSet(tf1), PoseSet(tf2)
+
+    q1, q2 = ps1.quaternions, ps2.quaternions
+    partners = _indexed_partners(q1, q2, window)
+
+    rng = np.random.default_rng(seed)
+    sample = rng.choice(len(ps1), size=min(n_validate, len(ps1)), replace=False)
+    theta_sum = _pairwise_rotation_angles(q1[sample], q1) + _pairwise_rotation_angles(q2[sample], q2)
+    theta_sum[np.arange(len(sample)), sample] = -np.inf
+    instrumentation.count("validation_pairs_evaluated", theta_sum.size)
+    optimal = theta_sum.max(axis=1)
+    picked = np.where(partners[sample] >= 0, theta_sum[np.arange(len(sample)), partners[sample]], 0.0)
+    deficit = optimal - picked
+
+    report = {
+        "n_validated": len(sample),
+        "agreement": float(np.mean(partners[sample] == np.argmax(theta_sum, axis=1))),
+        "mean_angle_deficit": float(np.mean(deficit)) if len(sample) else 0.0,
+        "max_angle_deficit": float(np.max(deficit)) if len(sample) else 0.0,
+    }
+
+    return _build_motions(ps1, ps2, partners), report
+
+
+@instrumentation.timed("select_motions")
+def robot_pose_selector(tf1, tf2, max_block_bytes=64 * 2**20, indexed=False, window=4):
+    if indexed:
+        motions, report = indexed_robot_pose_selector(tf1, tf2, window=window)
+        instrumentation.record("indexed_selection", [report["agreement"], report["max_angle_deficit"]])
+        instrumentation.message("Indexed selection matched the exact partner for {:.1%} of {} sampled poses "
+                                "(max screw angle deficit {:.4f} rad).".format(report["agreement"],
+                                                                               report["n_validated"],
+                                                                               report["max_angle_deficit"]))
+    else:
+        assert len(tf1) == len(tf2), "Nonmatching number of transforms."
+        ps1, ps2 = PoseSet(tf1), PoseSet(tf2)
+        motions = _build_motions(ps1, ps2, _exact_partners(ps1.quaternions, ps2.quaternions, max_block_bytes))
+
+    instrumentation.message("Obtained a total of {} motions.".format(len(motions)))
     return motions
 
 
+@instrumentation.timed("conditioning_select_motions")
+def conditioning_motion_selector(motions, k, antiparallel_screw_axes=False):
+    """
+    Greedily pick k of the candidate motions so that the 5th singular value of the
+    calibration matrix (the smallest one that should not vanish) is as large as possible.
+    The 8x8 normal matrix is updated with each picked motion's contribution and every
+    remaining candidate is scored with one batched 8x8 eigenvalue solve per step.
+    Candidates with anti-parallel screw axes are dropped.
+    """
+    A, B = motions_as_arrays(motions)
+    blocks = Calibrator4DOF._blocks_from_arrays(A, B, antiparallel_screw_axes, check_axes=False)
+    antiparallel = Calibrator4DOF.antiparallel_motions(blocks)
+    if antiparallel.any():
+        instrumentation.message("Ignoring {} motions with anti-parallel screw axes.".format(antiparallel.sum()))
+    contributions = np.einsum('nij,nik->njk', blocks, blocks)
+
+    TtT = np.zeros((8, 8))
+    remaining = ~antiparallel
+    selected = []
+    for _ in range(min(k, np.count_nonzero(remaining))):
+        candidates = np.flatnonzero(remaining)
+        # eigvalsh sorts ascending, so index 3 is the 5th largest eigenvalue.
+        score = np.linalg.eigvalsh(TtT + contributions[candidates])[:, 3]
+        best = candidates[np.argmax(score)]
+        TtT += contributions[best]
+        remaining[best] = False
+        selected.append(best)
+
+    return [(A[i], B[i]) for i in selected]
+
+
 def main():
     with open("../example_data/pose_samples.pkl", "rb") as f:
         try:
@@ -0,0 +1,72 @@
+import numpy as np
+from .dual_quaternions import DualQuaternionArray
+from .utils import matrix_to_quat
+
+
+class PoseSet:
+    """
+    Validated stack of (N, 4, 4) rigid transforms. Inverses, quaternions and dual
+    quaternions are computed in bulk the first time they are needed and cached.
+    Indexing and np.asarray behave like the underlying array, so a PoseSet can be
+    passed wherever a list of transforms is expected.
+    """
+    def __init__(self, transforms, tol=1e-5):
+        if isinstance(transforms, PoseSet):
+            transforms = transforms.transforms
+        tfs = np.asarray(transforms, dtype=np.float64)
+
+        assert tfs.ndim == 3 and tfs.shape[1:] == (4, 4), "Expected (N, 4, 4) transforms, got {}.".format(tfs.shape)
+        assert np.all(np.isfinite(tfs)), "Transforms contain non-finite values."
+        assert np.allclose(tfs[:, 3], [0, 0, 0, 1], atol=tol), "Transforms have an invalid bottom row."
+        R = tfs[:, :3, :3]
+        assert np.allclose(np.matmul(R, R.transpose(0, 2, 1)), np.eye(3), atol=tol), \
+            "Transforms have non-orthonormal rotations."
+
+        self.transforms = tfs
+        self._inverses = None
+        self._quaternions = None
+        self._dual_quaternions = None
+
+    def __len__(self):
+        return len(self.transforms)
+
+    def __getitem__(self, item):
+        return self.transforms[item]
+
+    def __iter__(self):
+        return iter(self.transforms)
+
+    def __array__(self, dtype=None, copy=None):
+        return self.transforms if dtype is None else self.transforms.astype(dtype)
+
+    @property
+    def rotations(self):
+        return self.transforms[:, :3, :3]
+
+    @property
+    def translations(self):
+        return self.transforms[:, :3, -1]
+
+    @property
+    def inverses(self):
+        if self._inverses is None:
+            # Closed form SE(3) inverse: [R^T, -R^T t]
+            Rt = self.rotations.transpose(0, 2, 1)
+            inv = np.zeros_like(self.transforms)
+            inv[:, :3, :3] = Rt
+            inv[:, :3, -1] = -np.matmul(Rt, self.translations[..., None])[..., 0]
+            inv[:, -1, -1] = 1
+            self._inverses = inv
+        return self._inverses
+
+    @property
+    def quaternions(self):
+        if self._quaternions is None:
+            self._quaternions = matrix_to_quat(self.rotations)
+        return self._quaternions
+
+    @property
+    def dual_quaternions(self):
+        if self._dual_quaternions is None:
+            self._dual_quaternions = DualQuaternionArray.from_pose(self.translations, self.quaternions)
+        return self._dual_quaternions
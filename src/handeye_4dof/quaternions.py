@@ -1,10 +1,73 @@
 import numpy as np
 
 
+def quat_multiply(q1, q2):
+    # Hamilton product over the last axis, broadcasting over any leading axes.
+    q1 = np.asarray(q1, dtype=np.float64)
+    q2 = np.asarray(q2, dtype=np.float64)
+    w1, x1, y1, z1 = q1[..., 0], q1[..., 1], q1[..., 2], q1[..., 3]
+    w2, x2, y2, z2 = q2[..., 0], q2[..., 1], q2[..., 2], q2[..., 3]
+    out = np.empty(np.broadcast_shapes(q1.shape, q2.shape), dtype=np.float64)
+    out[..., 0] = w1*w2 - x1*x2 - y1*y2 - z1*z2
+    out[..., 1] = w1*x2 + x1*w2 + y1*z2 - z1*y2
+    out[..., 2] = w1*y2 + y1*w2 + z1*x2 - x1*z2
+    out[..., 3] = w1*z2 + z1*w2 + x1*y2 - y1*x2
+    return out
+
+
+def quat_conjugate(q):
+    return np.asarray(q, dtype=np.float64) * [1, -1, -1, -1]
+
+
+def quat_slerp(q0, q1, t):
+    # Spherical linear interpolation from q0 (t = 0) to q1 (t = 1) along the shorter arc.
+    q0 = np.asarray(q0, dtype=np.float64)
+    q1 = np.asarray(q1, dtype=np.float64)
+    t = np.asarray(t, dtype=np.float64)[..., None]
+    cos_omega = np.sum(q0 * q1, axis=-1, keepdims=True)
+    q1 = np.where(cos_omega < 0, -q1, q1)
+    cos_omega = np.clip(np.abs(cos_omega), 0.0, 1.0)
+
+    omega = np.arccos(cos_omega)
+    sin_omega = np.sin(omega)
+    # Fall back to normalized linear interpolation for nearly identical rotations.
+    small = sin_omega < 1e-8
+    safe = np.where(small, 1.0, sin_omega)
+    w0 = np.where(small, 1 - t, np.sin((1 - t) * omega) / safe)
+    w1 = np.where(small, t, np.sin(t * omega) / safe)
+    q = w0 * q0 + w1 * q1
+    return q / np.linalg.norm(q, axis=-1, keepdims=True)
+
+
+def quat_as_axis_angle(q):
+    q = np.asarray(q, dtype=np.float64)
+    w, xyz = q[..., 0], q[..., 1:]
+    xyz_norm = np.linalg.norm(xyz, axis=-1)
+
+    small = xyz_norm < 1e-10
+    axis = xyz / np.where(small, 1.0, xyz_norm)[..., None]
+    axis[small] = [1.0, 0.0, 0.0]
+    angle = -((np.pi - 2 * np.arccos(w)) % (2.0 * np.pi) - np.pi)
+    angle = np.where(small, 0.0, angle)
+
+    flip = angle < 0.0
+    axis[flip] *= -1
+    angle = np.abs(angle)
+
+    return axis, angle
+
+
 class Quaternion:
     def __init__(self, quat):
         self.quat = np.array(quat, dtype=np.float64)
 
+    @classmethod
+    def _view(cls, quat):
+        # Wrap an existing length 4 array without copying it.
+        q = cls.__new__(cls)
+        q.quat = quat
+        return q
+
     def __add__(self, other):
         return Quaternion(self.quat + other.quat)
 
@@ -16,36 +79,70 @@ class Quaternion:
 
     def __mul__(self, other):
         if isinstance(other, Quaternion):
-            w1, x1, y1, z1 = self.quat
-            w2, x2, y2, z2 = other.quat
-            w = w1*w2 - x1*x2 - y1*y2 - z1*z2
-            x = w1*x2 + x1*w2 + y1*z2 - z1*y2
-            y = w1*y2 + y1*w2 + z1*x2 - x1*z2
-            z = w1*z2 + z1*w2 + x1*y2 - y1*x2
-            return Quaternion([w, x, y, z])
+            return Quaternion._view(quat_multiply(self.quat, other.quat))
+        if isinstance(other, QuaternionArray):
+            return QuaternionArray(quat_multiply(self.quat, other.quats))
         return Quaternion(other * self.quat)
 
     def __str__(self):
         return str(self.quat)
 
     def conjugate(self):
-        return Quaternion(self.quat * [1, -1, -1, -1])
+        return Quaternion._view(quat_conjugate(self.quat))
 
     def normalize(self):
         self.quat /= np.linalg.norm(self.quat)
 
     def as_axis_angle(self):
-        w, xyz = self.quat[0], self.quat[1:]
-        xyz_norm = np.linalg.norm(xyz)
+        axis, angle = quat_as_axis_angle(self.quat)
+        return axis, float(angle)
+
 
-        if xyz_norm < 1e-10:
-            return np.array([1.0, 0.0, 0.0]), 0.0
+class QuaternionArray:
+    """
+    Batch of N quaternions stored as a single (N, 4) array in wxyz order.
+    Indexing with an integer returns a Quaternion that views the underlying row.
+    """
+    def __init__(self, quats):
+        quats = np.asarray(quats, dtype=np.float64)
+        self.quats = quats.reshape(-1, 4) if quats.ndim != 2 else quats
 
-        axis = xyz / np.linalg.norm(xyz)
-        angle = -((np.pi - 2 * np.arccos(w)) % (2.0 * np.pi) - np.pi)
+    def __len__(self):
+        return len(self.quats)
 
-        if angle < 0.0:
-            axis *= -1
-            angle *= -1
+    def __getitem__(self, item):
+        if isinstance(item, (int, np.integer)):
+            return Quaternion._view(self.quats[item])
+        return QuaternionArray(self.quats[item])
 
-        return axis, angle
+    def __iter__(self):
+        for quat in self.quats:
+            yield Quaternion._view(quat)
+
+    def __add__(self, other):
+        return QuaternionArray(self.quats + other.quats)
+
+    def __neg__(self):
+        return QuaternionArray(-self.quats)
+
+    def __rmul__(self, other):
+        return QuaternionArray(np.multiply(np.asarray(other)[..., None], self.quats))
+
+    def __mul__(self, other):
+        if isinstance(other, QuaternionArray):
+            return QuaternionArray(quat_multiply(self.quats, other.quats))
+        if isinstance(other, Quaternion):
+            return QuaternionArray(quat_multiply(self.quats, other.quat))
+        return self.__rmul__(other)
+
+    def __str__(self):
+        return str(self.quats)
+
+    def conjugate(self):
+        return QuaternionArray(quat_conjugate(self.quats))
+
+    def normalize(self):
+        self.quats /= np.linalg.norm(self.quats, axis=-1, keepdims=True)
+
+    def as_axis_angle(self):
+        return quat_as_axis_angle(self.quats)
@@ -0,0 +1,286 @@
+"""
+Resident calibration service on localhost HTTP or a Unix socket, keeping poses,
+selected motions and the last calibration of every rig in memory between requests.
+
+GET    /rigs                    names of the known rigs
+GET    /rigs/<rig>              number of poses and motions and the last result of a rig
+POST   /rigs/<rig>/poses        {"base_to_hand": [4x4, ...], "camera_to_marker": [4x4, ...], "replace": false}
+DELETE /rigs/<rig>              forget a rig
+POST   /rigs/<rig>/calibrate    {"antiparallel_axes": false, "nonlinear": false, "sv_limit": 0.5, "wait": false}
+GET    /jobs/<job>              status ("pending", "running", "done" or "error") and result of a job
+
+Calibrations run asynchronously in a thread pool and return a job id (HTTP 202) unless
+"wait" is set. Motions are only re-selected after new poses arrived for a rig.
+"""
+
+import argparse
+import itertools
+import json
+import logging
+import os
+import re
+import socketserver
+import stat
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+from . import instrumentation
+from .batch import transform_summary
+from .cache import MotionCache, cached_robot_pose_selector
+from .calibrator import Calibrator4DOF, motions_as_arrays
+from .pose_selector import robot_pose_selector
+
+
+class _Rig:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.base_to_hand = np.zeros((0, 4, 4))
+        self.camera_to_marker = np.zeros((0, 4, 4))
+        self.motions = None
+        self.screws = None
+        self.result = None
+        # Incremented whenever the poses change, so selections on stale poses are not stored.
+        self.version = 0
+
+    def info(self):
+        return {"n_poses": len(self.base_to_hand),
+                "n_motions": None if self.motions is None else len(self.motions[0]),
+                "result": self.result}
+
+
+class CalibrationService:
+    def __init__(self, max_workers=None, cache=None, max_jobs=1000):
+        self.cache = cache
+        self.max_jobs = max_jobs
+        self._rigs = {}
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._job_ids = itertools.count(1)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def _rig(self, name, create=False):
+        with self._lock:
+            if name not in self._rigs:
+                assert create, "Unknown rig {}.".format(name)
+                self._rigs[name] = _Rig()
+            return self._rigs[name]
+
+    def rigs(self):
+        with self._lock:
+            return sorted(self._rigs)
+
+    def rig_info(self, name):
+        rig = self._rig(name)
+        with rig.lock:
+            return rig.info()
+
+    def remove_rig(self, name):
+        with self._lock:
+            assert self._rigs.pop(name, None) is not None, "Unknown rig {}.".format(name)
+
+    def add_poses(self, name, base_to_hand, camera_to_marker, replace=False):
+        base_to_hand = np.asarray(base_to_hand, dtype=np.float64).reshape(-1, 4, 4)
+        camera_to_marker = np.asarray(camera_to_marker, dtype=np.float64).reshape(-1, 4, 4)
+        assert len(base_to_hand) == len(camera_to_marker), "Got {} robot poses but {} sensor poses.".format(
+            len(base_to_hand), len(camera_to_marker))
+
+        rig = self._rig(name, create=True)
+        with rig.lock:
+            if not replace:
+                base_to_hand = np.concatenate((rig.base_to_hand, base_to_hand))
+                camera_to_marker = np.concatenate((rig.camera_to_marker, camera_to_marker))
+            rig.base_to_hand, rig.camera_to_marker = base_to_hand, camera_to_marker
+            rig.motions, rig.screws = None, None
+            rig.version += 1
+            return rig.info()
+
+    def _select_motions(self, base_to_hand, camera_to_marker):
+        # Runs without rig.lock on a snapshot of the poses. Screw parameters come from the cache.
+        screws = None
+        if self.cache is None:
+            motions = robot_pose_selector(camera_to_marker, base_to_hand)
+        else:
+            motions, screws = cached_robot_pose_selector(camera_to_marker, base_to_hand, self.cache,
+                                                         return_screws=True)
+        return motions_as_arrays(motions), screws
+
+    def calibrate(self, name, antiparallel_axes=False, nonlinear=False, sv_limit=0.5):
+        rig = self._rig(name)
+        with rig.lock:
+            assert len(rig.base_to_hand) > 1, "Rig {} needs at least two poses.".format(name)
+            motions, screws, version = rig.motions, rig.screws, rig.version
+            base_to_hand, camera_to_marker = rig.base_to_hand, rig.camera_to_marker
+
+        # Selection, solve and refinement run on a snapshot, so poses can be added meanwhile.
+        # The motions are kept until new poses arrive.
+        if motions is None:
+            motions, screws = self._select_motions(base_to_hand, camera_to_marker)
+            with rig.lock:
+                if rig.version == version:
+                    rig.motions, rig.screws = motions, screws
+        cb = Calibrator4DOF(motions, sv_limit=sv_limit, screws=screws)
+        dq_x = cb.calibrate(antiparallel_screw_axes=antiparallel_axes)
+        hand_to_camera = np.linalg.inv(dq_x.as_transform())
+        if nonlinear:
+            hand_to_camera = cb.nonlinear_refinement(camera_to_marker, base_to_hand, hand_to_camera)
+
+        result = dict(transform_summary(hand_to_camera), n_poses=len(base_to_hand), nonlinear=nonlinear)
+        with rig.lock:
+            rig.result = result
+        return result
+
+    def submit(self, name, **options):
+        self._rig(name)
+        job_id = str(next(self._job_ids))
+        job = {"id": job_id, "rig": name, "status": "pending"}
+
+        def run():
+            job["status"] = "running"
+            try:
+                job["result"] = self.calibrate(name, **options)
+                job["status"] = "done"
+            except Exception as e:
+                job["error"] = "{}: {}".format(type(e).__name__, e)
+                job["status"] = "error"
+            return job
+
+        with self._lock:
+            self._jobs[job_id] = job
+            while len(self._jobs) > self.max_jobs:
+                self._jobs.popitem(last=False)
+        job["future"] = self._executor.submit(run)
+        return job_id
+
+    def job(self, job_id, wait=False):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        assert job is not None, "Unknown job {}.".format(job_id)
+        if wait:
+            job["future"].result()
+        return {k: v for k, v in job.items() if k != "future"}
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    service = None
+
+    def address_string(self):
+        # Unix socket clients have no (host, port) address.
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "unix"
+
+    def log_message(self, fmt, *args):
+        instrumentation.logger.debug("%s %s", self.address_string(), fmt % args)
+
+    def _reply(self, code, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length)) if length else {}
+
+    def _dispatch(self, method):
+        try:
+            self._reply(*self._route(method, self.path.rstrip("/")))
+        except AssertionError as e:
+            self._reply(404 if str(e).startswith("Unknown") else 400, {"error": str(e)})
+        except KeyError as e:
+            self._reply(400, {"error": "Missing field {}.".format(e)})
+        except (ValueError, TypeError) as e:
+            self._reply(400, {"error": "{}: {}".format(type(e).__name__, e)})
+
+    def _route(self, method, path):
+        service = self.service
+        if method == "GET" and path == "/rigs":
+            return 200, {"rigs": service.rigs()}
+
+        m = re.fullmatch(r"/rigs/([\w.-]+)(/poses|/calibrate)?", path)
+        if m is not None:
+            name, action = m.groups()
+            if method == "GET" and action is None:
+                return 200, service.rig_info(name)
+            if method == "DELETE" and action is None:
+                service.remove_rig(name)
+                return 200, {"removed": name}
+            if method == "POST" and action == "/poses":
+                body = self._body()
+                return 200, service.add_poses(name, body["base_to_hand"], body["camera_to_marker"],
+                                              replace=body.get("replace", False))
+            if method == "POST" and action == "/calibrate":
+                body = self._body()
+                wait = body.pop("wait", False)
+                job_id = service.submit(name, **body)
+                return (200, service.job(job_id, wait=True)) if wait else (202, {"job": job_id})
+
+        m = re.fullmatch(r"/jobs/(\d+)", path)
+        if method == "GET" and m is not None:
+            return 200, service.job(m.group(1))
+
+        return 404, {"error": "No route for {} {}.".format(method, path)}
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_DELETE(self):
+        self._dispatch("DELETE")
+
+
+class _ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def make_server(service, host="127.0.0.1", port=8765, socket_path=None):
+    handler = type("Handler", (_Handler,), {"service": service})
+    if socket_path is None:
+        return ThreadingHTTPServer((host, port), handler)
+    if os.path.exists(socket_path):
+        # Only a socket left behind by an earlier run is replaced, never another kind of file.
+        assert stat.S_ISSOCK(os.stat(socket_path).st_mode), "{} exists and is not a socket.".format(socket_path)
+        os.remove(socket_path)
+    return _ThreadingUnixHTTPServer(socket_path, handler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Resident Handeye-4DOF calibration service.")
+    parser.add_argument("--host", default="127.0.0.1",
+                        help="address to listen on, keep it local")
+    parser.add_argument("--port", type=int, default=8765,
+                        help="TCP port to listen on")
+    parser.add_argument("--socket", dest="socket_path",
+                        help="listen on a Unix socket at this path instead of TCP")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="maximum number of calibrations running concurrently")
+    parser.add_argument("--cacheDir", dest="cache_dir",
+                        help="also keep selected motions in an on-disk motion cache")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    service = CalibrationService(max_workers=args.jobs,
+                                 cache=None if args.cache_dir is None else MotionCache(args.cache_dir))
+    server = make_server(service, args.host, args.port, args.socket_path)
+    instrumentation.message("Listening on {}.".format(args.socket_path or "http://{}:{}".format(args.host, args.port)))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
+        if args.socket_path is not None and os.path.exists(args.socket_path):
+            os.remove(args.socket_path)
+
+
+if __name__ == '__main__':
+    main()
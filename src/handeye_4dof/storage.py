@@ -0,0 +1,114 @@
+"""
+Pose and motion storage as uncompressed .npz archives.
+
+poses:   format_version, kind="poses",   first (N, 4, 4), second (N, 4, 4)
+motions: format_version, kind="motions", motions (N, 2, 8) dual quaternion vectors [A, B]
+
+Members are stored uncompressed so that they can be memory-mapped straight
+from the archive. Legacy pickle files are still accepted by the loaders.
+"""
+
+import argparse
+import pickle
+import zipfile
+import numpy as np
+from . import instrumentation
+from .calibrator import motions_as_arrays
+
+
+FORMAT_VERSION = 1
+
+
+def _load_pickle(path):
+    with open(path, "rb") as f:
+        try:
+            return pickle.load(f)
+        except UnicodeDecodeError:
+            # python 2 to python 3 pickle in case sampling was done in ROS
+            f.seek(0)
+            return pickle.load(f, encoding='latin1')
+
+
+def _mmap_npz_member(path, name):
+    # Locate the .npy payload of an uncompressed archive member and map it in place.
+    with zipfile.ZipFile(path) as zf:
+        info = zf.getinfo(name + ".npy")
+    assert info.compress_type == zipfile.ZIP_STORED, "Can't memory-map compressed member {}.".format(name)
+
+    with open(path, "rb") as f:
+        f.seek(info.header_offset)
+        local_header = f.read(30)
+        name_len = int.from_bytes(local_header[26:28], "little")
+        extra_len = int.from_bytes(local_header[28:30], "little")
+        f.seek(info.header_offset + 30 + name_len + extra_len)
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+
+    return np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=shape,
+                     order="F" if fortran_order else "C")
+
+
+def _open_archive(path, kind, members, mmap):
+    with np.load(path) as data:
+        version = int(data["format_version"])
+        assert version <= FORMAT_VERSION, "Unsupported {} file format version {}.".format(kind, version)
+        assert str(data["kind"]) == kind, "{} does not contain {}.".format(path, kind)
+        if not mmap:
+            return [data[m] for m in members]
+    return [_mmap_npz_member(path, m) for m in members]
+
+
+def save_poses(path, first, second):
+    first = np.asarray(first, dtype=np.float64)
+    second = np.asarray(second, dtype=np.float64)
+    assert first.shape == second.shape and first.shape[1:] == (4, 4), "Expected two (N, 4, 4) pose arrays."
+    # Writing through a file handle keeps path as given, np.savez would append .npz to it.
+    with open(path, "wb") as f:
+        np.savez(f, format_version=FORMAT_VERSION, kind="poses", first=first, second=second)
+
+
+@instrumentation.timed("load_poses")
+def load_poses(path, mmap=True):
+    if str(path).endswith(".pkl"):
+        first, second = _load_pickle(path)
+        return np.asarray(first, dtype=np.float64), np.asarray(second, dtype=np.float64)
+    return tuple(_open_archive(path, "poses", ["first", "second"], mmap))
+
+
+def save_motions(path, motions):
+    assert all(m is not None for m in motions), "Can't store motions without a partner pose."
+    A, B = motions_as_arrays(motions)
+    with open(path, "wb") as f:
+        np.savez(f, format_version=FORMAT_VERSION, kind="motions", motions=np.stack((A.dqs, B.dqs), axis=1))
+
+
+@instrumentation.timed("load_motions")
+def load_motions(path, mmap=True):
+    if str(path).endswith(".pkl"):
+        return _load_pickle(path)
+    return _open_archive(path, "motions", ["motions"], mmap)[0]
+
+
+def convert_pickle(src, dst):
+    data = _load_pickle(src)
+    # Pose pickles hold a pair of transform lists, motion pickles a list of dual quaternion pairs.
+    if len(data) == 2 and np.asarray(data[0][0]).shape == (4, 4):
+        save_poses(dst, *data)
+    else:
+        save_motions(dst, data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert pickled poses or motions to the .npz storage format.")
+    parser.add_argument("src", help="path to pickled poses or motions")
+    parser.add_argument("dst", help="path to the .npz file to write")
+    args = parser.parse_args()
+    convert_pickle(args.src, args.dst)
+
+
+if __name__ == '__main__':
+    main()
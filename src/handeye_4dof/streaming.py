@@ -0,0 +1,301 @@
+"""
+Timestamp synchronization of a robot kinematics stream and a (slower) marker
+detection stream. The robot stream is interpolated at the sensor timestamps
+(SLERP for rotations, linear for translations) and pairs are rejected when the
+bracketing robot samples are too far apart (stale) or the robot moves faster
+than the given velocity limits (motion blur). Only the samples still needed
+for interpolation are buffered, so arbitrarily long recordings fit in memory.
+
+Streams are iterables of (time, 4x4 transform) samples, or files read with
+read_stream: .npz archives with "times" (N,) and "transforms" (N, 4, 4), or
+text files with a timestamp followed by the 16 row-major transform entries per line.
+"""
+
+import argparse
+import heapq
+import logging
+import numpy as np
+from . import instrumentation
+from .dual_quaternions import DualQuaternionArray
+from .pose_set import PoseSet
+from .quaternions import quat_slerp
+from .storage import _mmap_npz_member, save_poses
+from .utils import quat_to_matrix
+
+
+def interpolate_transforms(times, transforms, query_times):
+    """
+    Interpolate the (N, 4, 4) transforms sampled at increasing times at the query times,
+    which must lie within [times[0], times[-1]]. Returns the (M, 4, 4) transforms and the
+    index of the sample preceding each query time.
+    """
+    times = np.asarray(times, dtype=np.float64)
+    query_times = np.asarray(query_times, dtype=np.float64)
+    ps = PoseSet(transforms)
+
+    i = np.clip(np.searchsorted(times, query_times, side="right") - 1, 0, max(len(times) - 2, 0))
+    j = np.minimum(i + 1, len(times) - 1)
+    dt = times[j] - times[i]
+    u = np.where(dt > 0, (query_times - times[i]) / np.where(dt > 0, dt, 1.0), 0.0)
+
+    q = ps.quaternions
+    out = np.zeros((len(query_times), 4, 4))
+    out[:, :3, :3] = quat_to_matrix(quat_slerp(q[i], q[j], u))
+    out[:, :3, -1] = (1 - u)[:, None] * ps.translations[i] + u[:, None] * ps.translations[j]
+    out[:, -1, -1] = 1
+    return out, i
+
+
+def transform_velocities(times, transforms):
+    # Linear (m/s) and angular (rad/s) speed between consecutive samples.
+    ps = PoseSet(transforms)
+    dt = np.diff(np.asarray(times, dtype=np.float64))
+    linear = np.linalg.norm(np.diff(ps.translations, axis=0), axis=-1)
+    cos_half = np.clip(np.abs(np.sum(ps.quaternions[1:] * ps.quaternions[:-1], axis=-1)), 0.0, 1.0)
+    angular = 2 * np.arccos(cos_half)
+    dt = np.where(dt > 0, dt, np.inf)
+    return linear / dt, angular / dt
+
+
+class StreamSynchronizer:
+    """
+    Incrementally pairs sensor samples with robot poses interpolated at the sensor timestamps.
+    Samples are pushed in chunks of increasing timestamps, and pop() returns every pair whose
+    sensor timestamp is already covered by the robot stream. Rejections are counted in stats.
+    Robot samples are kept for max_latency seconds, so sensor samples pushed up to that much
+    later than the robot samples around their timestamp can still be paired.
+    """
+    def __init__(self, max_gap=0.05, max_linear_velocity=None, max_angular_velocity=None, max_pending=10000,
+                 max_latency=1.0):
+        self.max_gap = max_gap
+        self.max_latency = max_latency
+        self.max_linear_velocity = max_linear_velocity
+        self.max_angular_velocity = max_angular_velocity
+        self.max_pending = max_pending
+        self.stats = {"accepted": 0, "rejected_stale": 0, "rejected_velocity": 0, "rejected_out_of_range": 0}
+        self._robot_times = np.zeros(0)
+        self._robot_tfs = np.zeros((0, 4, 4))
+        self._sensor_times = np.zeros(0)
+        self._sensor_tfs = np.zeros((0, 4, 4))
+
+    @staticmethod
+    def _append(times, tfs, new_times, new_tfs):
+        new_times = np.asarray(new_times, dtype=np.float64).reshape(-1)
+        new_tfs = np.asarray(new_tfs, dtype=np.float64).reshape(-1, 4, 4)
+        assert len(new_times) == len(new_tfs), "Got {} timestamps for {} transforms.".format(
+            len(new_times), len(new_tfs))
+        times = np.concatenate((times, new_times))
+        assert np.all(np.diff(times) >= 0), "Stream timestamps must be non-decreasing."
+        return times, np.concatenate((tfs, new_tfs))
+
+    def push_robot(self, times, transforms):
+        self._robot_times, self._robot_tfs = self._append(self._robot_times, self._robot_tfs, times, transforms)
+
+    def push_sensor(self, times, transforms):
+        self._sensor_times, self._sensor_tfs = self._append(self._sensor_times, self._sensor_tfs, times, transforms)
+        overflow = len(self._sensor_times) - self.max_pending
+        if overflow > 0:
+            self.stats["rejected_out_of_range"] += overflow
+            self._sensor_times, self._sensor_tfs = self._sensor_times[overflow:], self._sensor_tfs[overflow:]
+
+    def _trim_robot(self):
+        # Keep the robot samples from the last one at or before both latest - max_latency
+        # and the oldest pending sensor sample.
+        cutoff = self._robot_times[-1] - self.max_latency
+        if len(self._sensor_times):
+            cutoff = min(cutoff, self._sensor_times[0])
+        start = max(np.searchsorted(self._robot_times, cutoff, side="right") - 1, 0)
+        self._robot_times, self._robot_tfs = self._robot_times[start:], self._robot_tfs[start:]
+
+    def pop(self):
+        """
+        Returns (times, robot_poses, sensor_poses) of the newly synchronized pairs.
+        """
+        empty = np.zeros(0), np.zeros((0, 4, 4)), np.zeros((0, 4, 4))
+        if len(self._robot_times) == 0:
+            return empty
+
+        # Sensor samples before the first robot sample can never be interpolated.
+        early = np.searchsorted(self._sensor_times, self._robot_times[0], side="left")
+        self.stats["rejected_out_of_range"] += int(early)
+        ready = np.searchsorted(self._sensor_times, self._robot_times[-1], side="right")
+        times, sensor_tfs = self._sensor_times[early:ready], self._sensor_tfs[early:ready]
+        self._sensor_times, self._sensor_tfs = self._sensor_times[ready:], self._sensor_tfs[ready:]
+        if len(times) == 0:
+            self._trim_robot()
+            return empty
+
+        robot_tfs, i = interpolate_transforms(self._robot_times, self._robot_tfs, times)
+        j = np.minimum(i + 1, len(self._robot_times) - 1)
+        stale = (self._robot_times[j] - self._robot_times[i]) > self.max_gap
+
+        linear, angular = transform_velocities(self._robot_times, self._robot_tfs)
+        if len(linear):
+            linear, angular = linear[np.minimum(i, len(linear) - 1)], angular[np.minimum(i, len(linear) - 1)]
+        else:
+            linear, angular = np.zeros(len(times)), np.zeros(len(times))
+        fast = np.zeros(len(times), dtype=bool)
+        if self.max_linear_velocity is not None:
+            fast |= linear > self.max_linear_velocity
+        if self.max_angular_velocity is not None:
+            fast |= angular > self.max_angular_velocity
+        fast &= ~stale
+
+        keep = ~(stale | fast)
+        self.stats["rejected_stale"] += int(stale.sum())
+        self.stats["rejected_velocity"] += int(fast.sum())
+        self.stats["accepted"] += int(keep.sum())
+
+        self._trim_robot()
+        return times[keep], robot_tfs[keep], sensor_tfs[keep]
+
+    def finish(self):
+        # Sensor samples after the end of the robot stream can't be matched anymore.
+        self.stats["rejected_out_of_range"] += len(self._sensor_times)
+        self._sensor_times, self._sensor_tfs = self._sensor_times[:0], self._sensor_tfs[:0]
+
+
+def read_stream(path, chunk_size=4096):
+    # Yields the (time, transform) samples of a stream file.
+    if str(path).endswith(".npz"):
+        times, tfs = _mmap_npz_member(path, "times"), _mmap_npz_member(path, "transforms")
+        for start in range(0, len(times), chunk_size):
+            yield from zip(np.asarray(times[start:start + chunk_size]), np.asarray(tfs[start:start + chunk_size]))
+        return
+
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            values = np.array(line.replace(",", " ").split(), dtype=np.float64)
+            assert len(values) == 17, "Expected a timestamp and 16 transform entries, got {} values.".format(
+                len(values))
+            yield values[0], values[1:].reshape(4, 4)
+
+
+def synchronized_pairs(robot_stream, sensor_stream, chunk_size=256, **sync_options):
+    """
+    Merge two streams of (time, transform) samples by timestamp and yield chunks of
+    synchronized (times, robot_poses, sensor_poses). At most chunk_size samples are
+    read ahead of the synchronizer.
+    """
+    sync = StreamSynchronizer(**sync_options)
+    merged = heapq.merge(((t, 0, tf) for t, tf in robot_stream), ((t, 1, tf) for t, tf in sensor_stream),
+                         key=lambda sample: (sample[0], sample[1]))
+
+    def flush(chunk):
+        for source, push in ((0, sync.push_robot), (1, sync.push_sensor)):
+            samples = [(t, tf) for t, s, tf in chunk if s == source]
+            if samples:
+                push([t for t, _ in samples], [tf for _, tf in samples])
+        return sync.pop()
+
+    chunk = []
+    for sample in merged:
+        chunk.append(sample)
+        if len(chunk) >= chunk_size:
+            pairs, chunk = flush(chunk), []
+            if len(pairs[0]):
+                yield pairs
+    pairs = flush(chunk)
+    if len(pairs[0]):
+        yield pairs
+    sync.finish()
+
+    instrumentation.message("Synchronized {accepted} pose pairs, rejected {rejected_stale} stale, "
+                            "{rejected_velocity} too fast and {rejected_out_of_range} unmatched.".format(**sync.stats))
+
+
+def stream_motions(pairs, min_angle=0.2):
+    """
+    Turn chunks of synchronized (times, robot_poses, sensor_poses) into motions without
+    keeping the poses. Each pose is paired with the last used anchor pose once their summed
+    rotation angle (as in robot_pose_selector) exceeds min_angle, and then becomes the new anchor.
+    Yields (A, B) DualQuaternionArrays per chunk.
+    """
+    anchor = None
+    for _, robot_tfs, sensor_tfs in pairs:
+        robot, sensor = PoseSet(robot_tfs), PoseSet(sensor_tfs)
+        q_robot, q_sensor = robot.quaternions, sensor.quaternions
+
+        anchors, selected = [], []
+        for k in range(len(robot)):
+            if anchor is not None:
+                theta = (2 * np.arccos(np.clip(abs(q_robot[k].dot(anchor[2])), 0.0, 1.0)) +
+                         2 * np.arccos(np.clip(abs(q_sensor[k].dot(anchor[3])), 0.0, 1.0)))
+                if theta < min_angle:
+                    continue
+                anchors.append(anchor)
+                selected.append(k)
+            anchor = (robot[k], sensor[k], q_robot[k], q_sensor[k])
+
+        if selected:
+            anchor_robot = np.array([a[0] for a in anchors])
+            anchor_sensor = PoseSet([a[1] for a in anchors])
+            A = DualQuaternionArray.from_transform(np.matmul(sensor[selected], anchor_sensor.inverses))
+            B = DualQuaternionArray.from_transform(np.matmul(robot.inverses[selected], anchor_robot))
+            yield A, B
+
+
+def feed_incremental(calibrator, pairs, min_angle=0.2):
+    # Add streamed motions to an IncrementalCalibrator4DOF, returns the number of motions added.
+    n = 0
+    for A, B in stream_motions(pairs, min_angle):
+        for a, b in zip(A, B):
+            calibrator.add_motion(a, b)
+            n += 1
+    return n
+
+
+def collect_poses(pairs, max_poses=None):
+    """
+    Gather synchronized pairs as (base_to_hand, camera_to_marker) arrays for robot_pose_selector,
+    keeping only the max_poses most recent ones if given.
+    """
+    robot, sensor = [], []
+    n = 0
+    for _, robot_tfs, sensor_tfs in pairs:
+        robot.append(robot_tfs)
+        sensor.append(sensor_tfs)
+        n += len(robot_tfs)
+        while max_poses is not None and n - len(robot[0]) >= max_poses:
+            n -= len(robot.pop(0))
+            sensor.pop(0)
+
+    if not robot:
+        return np.zeros((0, 4, 4)), np.zeros((0, 4, 4))
+    robot, sensor = np.concatenate(robot), np.concatenate(sensor)
+    if max_poses is not None:
+        robot, sensor = robot[-max_poses:], sensor[-max_poses:]
+    return robot, sensor
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Synchronize robot and marker pose streams into calibration poses.")
+    parser.add_argument("robot", help="robot (base to hand) stream, .npz or text")
+    parser.add_argument("sensor", help="sensor (camera to marker) stream, .npz or text")
+    parser.add_argument("dst", help="path to the .npz poses file to write")
+    parser.add_argument("--maxGap", dest="max_gap", type=float, default=0.05,
+                        help="largest time between the robot samples used for interpolation in seconds")
+    parser.add_argument("--maxLinearVelocity", dest="max_linear_velocity", type=float,
+                        help="reject pairs taken while the robot moves faster than this in m/s")
+    parser.add_argument("--maxAngularVelocity", dest="max_angular_velocity", type=float,
+                        help="reject pairs taken while the robot rotates faster than this in rad/s")
+    parser.add_argument("--maxLatency", dest="max_latency", type=float, default=1.0,
+                        help="how long robot samples are kept for late sensor samples in seconds")
+    parser.add_argument("--maxPoses", dest="max_poses", type=int,
+                        help="keep only the most recent n pose pairs")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    pairs = synchronized_pairs(read_stream(args.robot), read_stream(args.sensor), max_gap=args.max_gap,
+                               max_linear_velocity=args.max_linear_velocity,
+                               max_angular_velocity=args.max_angular_velocity, max_latency=args.max_latency)
+    base_to_hand, camera_to_marker = collect_poses(pairs, args.max_poses)
+    save_poses(args.dst, base_to_hand, camera_to_marker)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Synthetic 4DOF (SCARA) calibration data with a known ground truth.
+
+Both calibration types are generated as robot_poses[i] X sensor_poses[i] = C,
+which is the form robot_pose_selector(sensor_poses, robot_poses) and
+Calibrator4DOF expect, with X = inv(dq_x.as_transform()).
+
+eye_in_hand: robot_poses = base_to_hand, sensor_poses = camera_to_marker, X = hand_to_camera
+eye_on_base: robot_poses = hand_to_base, sensor_poses = camera_to_marker, X = base_to_camera
+"""
+
+import numpy as np
+from .utils import euler_xyz_to_matrix, matrix_to_rotvec, rotvec_to_matrix
+
+
+def _transform(rotation, translation):
+    tf = np.zeros(rotation.shape[:-2] + (4, 4))
+    tf[..., :3, :3] = rotation
+    tf[..., :3, -1] = translation
+    tf[..., -1, -1] = 1
+    return tf
+
+
+def scara_poses(n, rng, workspace=0.3, z_range=(0.1, 0.3), yaw_range=(-1.2, 1.2)):
+    # Base to hand transforms of a SCARA arm: x, y, z translation and yaw only.
+    # Relative yaws near 180deg make the screw axis direction ambiguous, so the range is kept below that.
+    yaw = rng.uniform(*yaw_range, n)
+    translation = np.column_stack((rng.uniform(-workspace, workspace, (n, 2)), rng.uniform(*z_range, n)))
+    return _transform(euler_xyz_to_matrix(np.column_stack((np.zeros(n), np.zeros(n), yaw))), translation)
+
+
+def generate_scara_data(n, mode="eye_in_hand", trans_noise=0.0, rot_noise=0.0, outlier_fraction=0.0,
+                        ground_truth=None, seed=0):
+    """
+    Returns (robot_poses, sensor_poses, X) as (N, 4, 4) arrays and the 4x4 ground truth X.
+    Sensor poses get Gaussian translation (m) and rotation (rad) noise, and a
+    outlier_fraction of them is replaced by grossly perturbed detections.
+    """
+    assert mode in ("eye_in_hand", "eye_on_base"), "Unknown calibration mode {}.".format(mode)
+    rng = np.random.default_rng(seed)
+
+    if ground_truth is None:
+        # Camera looking down from the hand (eye-in-hand) or from above the base (eye-on-base).
+        ground_truth = _transform(euler_xyz_to_matrix([180, 2, -3], degrees=True),
+                                  [-0.45, -0.04, -0.1] if mode == "eye_in_hand" else [0.4, 0.1, 1.2])
+    X = np.asarray(ground_truth, dtype=np.float64)
+
+    base_to_hand = scara_poses(n, rng)
+    robot_poses = base_to_hand if mode == "eye_in_hand" else np.linalg.inv(base_to_hand)
+
+    # Fixed base to marker (eye-in-hand) or hand to marker (eye-on-base) transform.
+    C = _transform(euler_xyz_to_matrix([175, 4, 30], degrees=True),
+                   [0.5, 0.2, -0.3] if mode == "eye_in_hand" else [0.0, 0.05, -0.02])
+    sensor_poses = np.matmul(np.linalg.inv(np.matmul(robot_poses, X)), C)
+
+    noise = _transform(rotvec_to_matrix(rng.normal(0, rot_noise, (n, 3))),
+                       rng.normal(0, trans_noise, (n, 3)))
+
+    n_outliers = int(round(outlier_fraction * n))
+    outliers = rng.choice(n, n_outliers, replace=False)
+    noise[outliers] = _transform(rotvec_to_matrix(rng.normal(0, 0.3, (n_outliers, 3))),
+                                 rng.normal(0, 0.2, (n_outliers, 3)))
+
+    return robot_poses, np.matmul(sensor_poses, noise), X
+
+
+def calibration_error(estimate, ground_truth):
+    # xy translation error (m) and rotation angle error (rad); tz is not observable for 4DOF arms.
+    translation = np.linalg.norm(estimate[:2, -1] - ground_truth[:2, -1])
+    rotation = np.linalg.norm(matrix_to_rotvec(estimate[:3, :3].T.dot(ground_truth[:3, :3])))
+    return float(translation), float(rotation)
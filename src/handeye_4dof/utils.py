@@ -1,29 +1,126 @@
 import numpy as np
-from scipy.spatial.transform import Rotation as R
 
 
 def matrix_to_quat(mat):
-    quat = R.from_matrix(mat).as_quat()
-    # xyzw -> wxyz
-    quat[1], quat[2], quat[3], quat[0] = quat[0], quat[1], quat[2], quat[3]
-    return quat
+    # Accepts a single (3, 3) matrix or a stack of (N, 3, 3) matrices, returns wxyz quaternions.
+    # Shepperd's method: build the quaternion from whichever of w, x, y, z has the largest
+    # magnitude, so the normalization never divides by a small number.
+    mat = np.asarray(mat, dtype=np.float64)
+    r00, r01, r02, r10, r11, r12, r20, r21, r22 = mat.reshape(-1, 9).T
+    trace = r00 + r11 + r22
+    d21, d02, d10 = r21 - r12, r02 - r20, r10 - r01
+    s10, s02, s21 = r10 + r01, r02 + r20, r21 + r12
+
+    # Candidate (unnormalized) quaternions led by x, y, z and w.
+    candidates = np.empty((len(trace), 4, 4))
+    candidates[:, 0] = np.column_stack((d21, 1 + 2 * r00 - trace, s10, s02))
+    candidates[:, 1] = np.column_stack((d02, s10, 1 + 2 * r11 - trace, s21))
+    candidates[:, 2] = np.column_stack((d10, s02, s21, 1 + 2 * r22 - trace))
+    candidates[:, 3] = np.column_stack((1 + trace, d21, d02, d10))
+    choice = np.argmax(np.column_stack((r00, r11, r22, trace)), axis=1)
+
+    quat = candidates[np.arange(len(trace)), choice]
+    quat /= np.linalg.norm(quat, axis=1, keepdims=True)
+    return quat.reshape(mat.shape[:-2] + (4,))
 
 
 def quat_to_matrix(quat):
-    quat = quat.copy()
-    # wxyz -> xyzw
-    quat[0], quat[1], quat[2], quat[3] = quat[1], quat[2], quat[3], quat[0]
-    return R.from_quat(quat).as_matrix()
+    # Accepts a single (4,) quaternion or a stack of (N, 4) quaternions in wxyz order.
+    quat = np.asarray(quat, dtype=np.float64)
+    w, x, y, z = quat.reshape(-1, 4).T
+    ww, xx, yy, zz = w*w, x*x, y*y, z*z
+    xy, xz, yz, wx, wy, wz = x*y, x*z, y*z, w*x, w*y, w*z
+    # Dividing by the squared norm normalizes the quaternion.
+    s = 2 / (ww + xx + yy + zz)
+
+    mat = np.empty((len(w), 9))
+    mat[:, 0], mat[:, 1], mat[:, 2] = 1 - s*(yy + zz), s*(xy - wz), s*(xz + wy)
+    mat[:, 3], mat[:, 4], mat[:, 5] = s*(xy + wz), 1 - s*(xx + zz), s*(yz - wx)
+    mat[:, 6], mat[:, 7], mat[:, 8] = s*(xz - wy), s*(yz + wx), 1 - s*(xx + yy)
+    return mat.reshape(quat.shape[:-1] + (3, 3))
 
 
 def vec_to_skew_symmetric_mat(vec):
-    v1, v2, v3 = vec
-    mat = np.array([[0.0, -v3, v2],
-                    [v3, 0.0, -v1],
-                    [-v2, v1, 0.0]])
+    # Accepts a single (3,) vector or a stack of (N, 3) vectors.
+    vec = np.asarray(vec, dtype=np.float64)
+    v1, v2, v3 = vec[..., 0], vec[..., 1], vec[..., 2]
+    mat = np.zeros(vec.shape[:-1] + (3, 3))
+    mat[..., 0, 1], mat[..., 0, 2] = -v3, v2
+    mat[..., 1, 0], mat[..., 1, 2] = v3, -v1
+    mat[..., 2, 0], mat[..., 2, 1] = -v2, v1
+    return mat
+
+
+def rotvec_to_matrix(w):
+    # Rodrigues' formula, for a single (3,) rotation vector or a stack of (N, 3).
+    w = np.asarray(w, dtype=np.float64)
+    theta = np.linalg.norm(w, axis=-1)[..., None, None]
+    K = vec_to_skew_symmetric_mat(w)
+    small = theta < 1e-6
+    safe = np.where(small, 1.0, theta)
+    # Taylor expansions of sin(t) / t and (1 - cos(t)) / t^2 near zero.
+    a = np.where(small, 1 - theta**2 / 6, np.sin(safe) / safe)
+    b = np.where(small, 0.5 - theta**2 / 24, (1 - np.cos(safe)) / safe**2)
+    return np.eye(3) + a * K + b * np.matmul(K, K)
+
+
+def matrix_to_rotvec(mat):
+    # Rotation vectors (axis * angle) of (3, 3) or (N, 3, 3) rotation matrices.
+    quat = matrix_to_quat(mat)
+    # Use the w >= 0 hemisphere so the angle lies in [0, pi].
+    quat = np.where(quat[..., :1] < 0, -quat, quat)
+    xyz_norm = np.linalg.norm(quat[..., 1:], axis=-1, keepdims=True)
+    angle = 2 * np.arctan2(xyz_norm, quat[..., :1])
+    return quat[..., 1:] * np.where(xyz_norm > 1e-12, angle / np.where(xyz_norm > 1e-12, xyz_norm, 1.0), 2.0)
+
+
+def euler_xyz_to_matrix(angles, degrees=False):
+    # Extrinsic x, y, z rotations (R = Rz Ry Rx) of (3,) or (N, 3) angles.
+    angles = np.asarray(angles, dtype=np.float64)
+    if degrees:
+        angles = np.deg2rad(angles)
+    ca, cb, cc = np.cos(angles[..., 0]), np.cos(angles[..., 1]), np.cos(angles[..., 2])
+    sa, sb, sc = np.sin(angles[..., 0]), np.sin(angles[..., 1]), np.sin(angles[..., 2])
+
+    mat = np.empty(angles.shape[:-1] + (3, 3))
+    mat[..., 0, 0] = cc*cb
+    mat[..., 0, 1] = cc*sb*sa - sc*ca
+    mat[..., 0, 2] = cc*sb*ca + sc*sa
+    mat[..., 1, 0] = sc*cb
+    mat[..., 1, 1] = sc*sb*sa + cc*ca
+    mat[..., 1, 2] = sc*sb*ca - cc*sa
+    mat[..., 2, 0] = -sb
+    mat[..., 2, 1] = cb*sa
+    mat[..., 2, 2] = cb*ca
     return mat
 
 
+def matrix_to_euler_xyz(mat, degrees=False):
+    # Inverse of euler_xyz_to_matrix with x, z in (-pi, pi] and y in [-pi/2, pi/2].
+    # At gimbal lock (y = +-pi/2) the z angle is set to zero.
+    mat = np.asarray(mat, dtype=np.float64)
+    sb = np.clip(-mat[..., 2, 0], -1.0, 1.0)
+    b = np.arcsin(sb)
+    lock = np.abs(sb) > 1 - 1e-10
+    a = np.where(lock, np.arctan2(sb * mat[..., 0, 1], mat[..., 1, 1]), np.arctan2(mat[..., 2, 1], mat[..., 2, 2]))
+    c = np.where(lock, 0.0, np.arctan2(mat[..., 1, 0], mat[..., 0, 0]))
+    angles = np.stack((a, b, c), axis=-1)
+    return np.rad2deg(angles) if degrees else angles
+
+
+def rotvec_to_matrix_jacobian(w):
+    # (3, 3, 3) stack of dR/dw_k for R = exp([w]x).
+    # source: Gallego & Yezzi, "A compact formula for the derivative of a 3-D rotation in exponential coordinates"
+    theta = np.linalg.norm(w)
+    E = vec_to_skew_symmetric_mat(np.eye(3))
+    if theta < 1e-12:
+        return E
+    R = rotvec_to_matrix(w)
+    K = vec_to_skew_symmetric_mat(w)
+    cols = vec_to_skew_symmetric_mat(np.cross(w, (np.eye(3) - R).T))
+    return np.matmul((w[:, None, None] * K + cols) / theta**2, R)
+
+
 def obtain_tf_from_rolled_arr(xi):
     # xi := ux, vx, wx, tx, uy, vy, wy, ty, uz, vz, wz
     # For calibration, we do not care about tz as we cannot solve for it anyways
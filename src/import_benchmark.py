@@ -0,0 +1,66 @@
+"""
+Measures the import time of handeye_4dof modules in fresh interpreters and checks
+that none of the heavy optional dependencies are loaded by the import. The exit
+status is non-zero if a forbidden module was imported or the median import time
+exceeds --limit, so the script can guard the lightweight core in CI.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import numpy as np
+
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"elapsed": elapsed, "modules": sorted({{m.split(".")[0] for m in sys.modules}})}}))
+"""
+
+
+def measure(module, env):
+    # numpy is imported first so that only the package's own import cost is timed.
+    out = subprocess.check_output([sys.executable, "-c", "import numpy\n" + PROBE.format(module=module)], env=env)
+    return json.loads(out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Handeye-4DOF import time benchmark.")
+    parser.add_argument("--modules", nargs="+", default=["handeye_4dof", "handeye_4dof.storage", "handeye_4dof.cache",
+                                                         "handeye_4dof.streaming", "handeye_4dof.evaluation"],
+                        help="modules to import")
+    parser.add_argument("--forbidden", nargs="+", default=["scipy", "sympy", "multiprocessing"],
+                        help="top level modules that must not be loaded by the imports")
+    parser.add_argument("--repeat", type=int, default=10,
+                        help="number of fresh interpreters per module")
+    parser.add_argument("--limit", type=float,
+                        help="fail if the median import time of a module exceeds this many seconds")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    src_dir = os.path.dirname(os.path.abspath(__file__))
+    env["PYTHONPATH"] = os.pathsep.join(p for p in (src_dir, env.get("PYTHONPATH")) if p)
+
+    failed = False
+    for module in args.modules:
+        runs = [measure(module, env) for _ in range(args.repeat)]
+        median = float(np.median([r["elapsed"] for r in runs]))
+        loaded = sorted(set(args.forbidden) & set(runs[0]["modules"]))
+
+        status = "ok"
+        if loaded:
+            status = "loads {}".format(", ".join(loaded))
+        elif args.limit is not None and median > args.limit:
+            status = "slower than {:.3f}s".format(args.limit)
+        failed |= status != "ok"
+        print("{:<28s} {:8.1f} ms  {}".format(module, 1e3 * median, status))
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
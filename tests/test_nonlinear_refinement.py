@@ -0,0 +1,33 @@
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from handeye_4dof import Calibrator4DOF, robot_pose_selector
+from handeye_4dof.storage import load_poses
+from handeye_4dof.synthetic import generate_scara_data
+
+
+pytest.importorskip("scipy")
+
+DATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "example_data", "pose_samples.pkl")
+
+
+def calibration_problems():
+    base_to_hand, camera_to_marker = load_poses(DATA_PATH)
+    yield np.asarray(base_to_hand), np.asarray(camera_to_marker), True
+    robot_poses, sensor_poses, _ = generate_scara_data(60, trans_noise=5e-4, rot_noise=5e-4, seed=0)
+    yield robot_poses, sensor_poses, True
+
+
+@pytest.mark.parametrize("problem", list(calibration_problems()), ids=["example", "synthetic"])
+def test_least_squares_matches_slsqp(problem):
+    base_to_hand, camera_to_marker, antiparallel = problem
+    cb = Calibrator4DOF(robot_pose_selector(camera_to_marker, base_to_hand))
+    hand_to_camera = np.linalg.inv(cb.calibrate(antiparallel_screw_axes=antiparallel).as_transform())
+
+    expected = cb.nonlinear_refinement(camera_to_marker, base_to_hand, hand_to_camera, method="slsqp")
+    actual = cb.nonlinear_refinement(camera_to_marker, base_to_hand, hand_to_camera)
+    np.testing.assert_allclose(actual, expected, atol=1e-4)
@@ -0,0 +1,49 @@
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from handeye_4dof import robot_pose_selector
+from handeye_4dof.calibrator import motions_as_arrays
+from handeye_4dof.dual_quaternions import DualQuaternion
+from handeye_4dof.storage import load_poses
+from handeye_4dof.synthetic import generate_scara_data
+
+
+DATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "example_data", "pose_samples.pkl")
+
+
+def reference_pose_selector(tf1, tf2):
+    # The original pairwise loop, which the vectorized selector must reproduce.
+    motions = [None for _ in range(len(tf1))]
+    for i, (Ai, Bi) in enumerate(zip(tf1, tf2)):
+        curr_theta_max = 0
+        for j, (Aj, Bj) in enumerate(zip(tf1, tf2)):
+            if i == j: continue
+            A = DualQuaternion.from_transform(np.dot(Aj, np.linalg.inv(Ai)))
+            B = DualQuaternion.from_transform(np.dot(np.linalg.inv(Bj), Bi))
+            theta_sum = np.sum(np.abs([A.as_screw_params()[-1], B.as_screw_params()[-1]]))
+            if theta_sum > curr_theta_max:
+                curr_theta_max = theta_sum
+                motions[i] = (A, B)
+    return motions
+
+
+def pose_sets():
+    base_to_hand, camera_to_marker = load_poses(DATA_PATH)
+    yield np.asarray(base_to_hand), np.asarray(camera_to_marker)
+    for seed in range(2):
+        robot_poses, sensor_poses, _ = generate_scara_data(60, trans_noise=5e-4, rot_noise=5e-4, seed=seed)
+        yield robot_poses, sensor_poses
+
+
+@pytest.mark.parametrize("poses", list(pose_sets()), ids=["example", "synthetic_0", "synthetic_1"])
+@pytest.mark.parametrize("max_block_bytes", [64 * 2**20, 4096])
+def test_matches_reference_selector(poses, max_block_bytes):
+    base_to_hand, camera_to_marker = poses
+    expected_A, expected_B = motions_as_arrays(reference_pose_selector(camera_to_marker, base_to_hand))
+    A, B = motions_as_arrays(robot_pose_selector(camera_to_marker, base_to_hand, max_block_bytes=max_block_bytes))
+    np.testing.assert_allclose(A.dqs, expected_A.dqs, atol=1e-12)
+    np.testing.assert_allclose(B.dqs, expected_B.dqs, atol=1e-12)
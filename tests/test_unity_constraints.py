@@ -0,0 +1,32 @@
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from handeye_4dof import Calibrator4DOF
+from handeye_4dof.storage import load_motions
+
+
+sympy = pytest.importorskip("sympy")
+
+DATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "example_data", "paired_poses.pkl")
+
+
+def motion_sets():
+    motions = list(load_motions(DATA_PATH))
+    yield motions
+    for seed in range(3):
+        subset = np.random.default_rng(seed).choice(len(motions), size=60, replace=False)
+        yield [motions[i] for i in sorted(subset)]
+
+
+@pytest.mark.parametrize("motions", list(motion_sets()), ids=["all", "seed_0", "seed_1", "seed_2"])
+def test_closed_form_matches_symbolic_and_dense_svd(motions):
+    cb = Calibrator4DOF(motions)
+    # Compare transforms, the dual quaternions are only defined up to sign.
+    expected = cb.calibrate(antiparallel_screw_axes=True).as_transform()
+    for kwargs in ({"symbolic": True}, {"dense_svd": True}, {"symbolic": True, "dense_svd": True}):
+        actual = cb.calibrate(antiparallel_screw_axes=True, **kwargs).as_transform()
+        np.testing.assert_allclose(actual, expected, atol=1e-8, err_msg=str(kwargs))